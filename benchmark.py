@@ -0,0 +1,328 @@
+'''
+benchmark.py times the parts of the simulation that matter for performance and writes the
+results as JSON so that runs can be compared against a saved baseline.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --sizes 50 100 --baseline bench.json
+    python benchmark.py --imports-only
+
+Timed: importing the simulation core in a fresh interpreter, Simulation.run_iteration for both engines, _get_neighbors, building the neighbor table,
+every LearningDynamic (per agent and batched), the well-mixed partner draw of the vectorized
+engine, run_iteration on a settled grid with and without active-set updates, an ensemble of
+replicas against the same replicas run one by one, and update_grid-style rendering. Every
+GameType is swept, so both typed (Battle of Sexes) and untyped games are covered. Radius 0 is
+the well-mixed population, where _get_neighbors and the dynamics learn from random agents.
+
+The imports are held to a budget (--import-budget) since sweep workers and short runs pay them
+on every start: going over it, or loading a GUI or export module such as matplotlib, fails the
+run like a regression does. --imports-only times just the imports, which takes a few seconds,
+so the budget can be checked on every commit.
+'''
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import datetime
+import numpy as np
+from simulation import Simulation, SpatialConfig
+from sim.game import GameType
+from sim.dynamics import LearningDynamic
+from sim.neighborhood import NeighborTable
+
+DYNAMICS = ['replicator', 'fermi', 'moran', 'random_copy', 'aspiration']
+
+# fields that identify a benchmark, everything else is a measurement
+KEY_FIELDS = ['name', 'module', 'engine', 'game', 'dynamic', 'size', 'radius', 'replicas']
+
+# entry points that must import quickly, and the modules they must not load
+CORE_MODULES = ['simulation', 'sim.run', 'sim.sweep', 'main']
+HEAVY_MODULES = ['matplotlib', 'tkinter', 'pandas', 'pyarrow', 'multiprocessing.shared_memory']
+# seconds each of them may take in a new interpreter
+IMPORT_BUDGET = 0.25
+
+# run fn once to warm up, then time it `repeats` times
+def measure(fn, repeats):
+    fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {
+        'seconds_min': min(times),
+        'seconds_median': statistics.median(times),
+        'repeats': repeats
+    }
+
+# import `module` in a new interpreter, like a sweep worker or a headless run starts
+def bench_import(module, repeats):
+    code = (f"import sys, time\nstart = time.perf_counter()\nimport {module}\n"
+            f"print(time.perf_counter() - start)\n"
+            f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    root = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    # the first run only warms up the file cache
+    for _ in range(repeats + 1):
+        output = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True,
+                                check=True).stdout.split('\n')
+        times.append(float(output[0]))
+    return {
+        'seconds_min': min(times[1:]),
+        'seconds_median': statistics.median(times[1:]),
+        'repeats': repeats,
+        'heavy_modules': output[1].split()
+    }
+
+def make_simulation(game_type, dynamic, size, radius, engine, seed=0):
+    game_config = game_type.value
+    random.seed(seed)
+    np.random.seed(seed)
+    config = SpatialConfig(size=size, radius=radius, strategy_distribution=game_config.default_distribution)
+    return Simulation(game_type, config, getattr(LearningDynamic, dynamic),
+                      agent_types=game_config.agent_types or [], engine=engine, seed=seed)
+
+def bench_run_iteration(game_type, dynamic, size, radius, engine, repeats):
+    sim = make_simulation(game_type, dynamic, size, radius, engine)
+    result = measure(sim.run_iteration, repeats)
+    result['iterations_per_second'] = 1 / result['seconds_median']
+    return result
+
+# one call per agent, i.e. the neighbor lookups of a single object-path iteration. at radius 0
+# this is the well-mixed draw of a partner (and of an agent of the same type in typed games)
+def bench_get_neighbors(game_type, size, radius, repeats):
+    sim = make_simulation(game_type, 'replicator', size, radius, 'object')
+    agents = list(sim.grid.flat)
+    return measure(lambda: [sim._get_neighbors(agent) for agent in agents], repeats)
+
+# the well-mixed draws of one vectorized iteration: a partner for every agent, and in typed
+# games an agent of the same type to learn from
+def bench_well_mixed_partners(game_type, size, repeats):
+    vec = make_simulation(game_type, 'replicator', size, 0, 'vectorized').engine
+    return measure(lambda: _well_mixed_pool(vec), repeats)
+
+# the agents that the well-mixed vectorized engine learns from, as its step draws them
+def _well_mixed_pool(vec):
+    partners = vec.mixing.partners(vec.rng)
+    pool = vec.mixing.partners(vec.rng, same_type=True) if vec.agent_types else partners
+    pool = pool[:, None]
+    return pool, (pool >= 0 if (pool < 0).any() else None)
+
+def bench_neighbor_table(size, radius, repeats):
+    return measure(lambda: NeighborTable(size, radius), repeats)
+
+# the learning dynamic alone, applied to every agent once
+def bench_dynamic(game_type, dynamic, size, radius, engine, repeats):
+    sim = make_simulation(game_type, dynamic, size, radius, engine)
+    sim.run_iteration()
+    if engine != 'object':
+        vec = sim.engine
+        pool, valid = _well_mixed_pool(vec) if vec.well_mixed else (vec.neighbors, vec.learn_valid)
+        return measure(lambda: vec.update_rule(vec.population.scores, vec.population.strategies, pool, valid, vec.rng), repeats)
+    rule = sim.dynamic
+    agents = list(sim.grid.flat)
+    neighbors = [sim._get_neighbors(agent) for agent in agents]
+    return measure(lambda: [rule(agent, list(n)) for agent, n in zip(agents, neighbors)], repeats)
+
+# run_iteration once most of the grid has settled into uniform regions: Stag Hunt between the
+# two pure strategies coarsens within a few dozen iterations under replicator
+def bench_settled(size, radius, active_set, repeats):
+    random.seed(0)
+    config = SpatialConfig(size=size, radius=radius, strategy_distribution={'Always Stag': 0.5, 'Always Hare': 0.5})
+    sim = Simulation(GameType.SH, config, LearningDynamic.replicator, engine='vectorized', seed=0,
+                     active_set=active_set)
+    for _ in range(30):
+        sim.run_iteration()
+    return measure(sim.run_iteration, repeats)
+
+# one iteration of `replicas` grids, as one Ensemble or as separate Simulations
+def bench_ensemble(size, radius, replicas, batched, repeats):
+    from sim.ensemble import build_ensemble
+    from sim.run import build_simulation
+    if batched:
+        ensemble = build_ensemble(GameType.PD, 'replicator', replicas, radius, size, seed=0)
+        return measure(ensemble.run_iteration, repeats)
+    sims = [build_simulation(GameType.PD, 'replicator', radius, size, engine='vectorized', seed=r) for r in range(replicas)]
+
+    def run_all():
+        for sim in sims:
+            sim.run_iteration()
+    return measure(run_all, repeats)
+
+# same work as SimulationGUI.update_grid, drawn on an offscreen canvas
+def bench_render(game_type, size, engine, repeats):
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.patches import Patch
+    from sim.render import GridRenderer
+
+    sim = make_simulation(game_type, 'replicator', size, 1, engine)
+    fig = Figure(figsize=(6, 6))
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    img = ax.imshow(np.zeros((size, size, 3), dtype=np.uint8), interpolation='nearest')
+    ax.axis('off')
+    ax.legend(handles=[Patch(facecolor=color, label=name) for name, color in game_type.value.strategy_colors.items()],
+              loc='upper right')
+    # the GUI shows the iteration counter in a Tk label, outside the figure
+    renderer = GridRenderer(canvas, ax, img)
+    renderer.set_colors(game_type.value)
+    # the first frame draws the whole figure, later ones only blit
+    renderer.draw(sim.strategy_grid())
+
+    def render():
+        renderer.draw(sim.strategy_grid())
+    return measure(render, repeats)
+
+def run_benchmarks(args):
+    results = []
+
+    def record(fields, fn, *fn_args):
+        key = {name: fields.get(name) for name in KEY_FIELDS}
+        # neighbor tables and gathered scores grow with size^2 * neighbors
+        neighbors = (2 * max(key['radius'] or 0, 1) + 1) ** 2 - 1
+        if key['size'] and key['size'] ** 2 * (key['replicas'] or 1) * neighbors > args.max_cell_neighbors:
+            results.append({**key, 'skipped': 'over --max-cell-neighbors'})
+            return
+        if key['engine'] == 'parallel' and key['radius'] == 0:
+            results.append({**key, 'skipped': 'the parallel engine needs radius >= 1'})
+            return
+        if key['engine'] == 'object' and key['size'] > args.max_object_size:
+            results.append({**key, 'skipped': 'over --max-object-size'})
+            return
+        print(f"{key}", file=sys.stderr)
+        results.append({**key, **fn(*fn_args)})
+
+    for module in CORE_MODULES:
+        record({'name': 'import', 'module': module}, bench_import, module, args.repeats)
+    if args.imports_only:
+        return results
+
+    for size in args.sizes:
+        for radius in args.radii:
+            for game_type in GameType:
+                for engine in args.engines:
+                    record({'name': 'run_iteration', 'engine': engine, 'game': game_type.name,
+                            'dynamic': args.dynamic, 'size': size, 'radius': radius},
+                           bench_run_iteration, game_type, args.dynamic, size, radius, engine, args.repeats)
+            for game_type in (GameType.PD, GameType.BS):
+                record({'name': 'get_neighbors', 'engine': 'object', 'game': game_type.name, 'size': size,
+                        'radius': radius},
+                       bench_get_neighbors, game_type, size, radius, args.repeats)
+                if radius == 0 and 'vectorized' in args.engines:
+                    record({'name': 'well_mixed_partners', 'engine': 'vectorized', 'game': game_type.name,
+                            'size': size, 'radius': radius},
+                           bench_well_mixed_partners, game_type, size, args.repeats)
+                for dynamic in DYNAMICS:
+                    for engine in args.engines:
+                        record({'name': 'dynamic', 'engine': engine, 'game': game_type.name,
+                                'dynamic': dynamic, 'size': size, 'radius': radius},
+                               bench_dynamic, game_type, dynamic, size, radius, engine, args.repeats)
+            if radius >= 1:
+                record({'name': 'neighbor_table', 'size': size, 'radius': radius},
+                       bench_neighbor_table, size, radius, args.repeats)
+                for name, active_set in (('settled_iteration', False), ('settled_iteration_active', True)):
+                    record({'name': name, 'engine': 'vectorized', 'game': 'SH', 'dynamic': 'replicator',
+                            'size': size, 'radius': radius},
+                           bench_settled, size, radius, active_set, args.repeats)
+                for name, batched in (('ensemble', True), ('ensemble_separate', False)):
+                    record({'name': name, 'engine': 'vectorized', 'game': 'PD', 'dynamic': 'replicator',
+                            'size': size, 'radius': radius, 'replicas': args.replicas},
+                           bench_ensemble, size, radius, args.replicas, batched, args.repeats)
+        for engine in args.engines:
+            record({'name': 'render', 'engine': engine, 'game': 'PD', 'size': size, 'radius': 1},
+                   bench_render, GameType.PD, size, engine, args.repeats)
+    return results
+
+# compare against a baseline file, returns the list of regressed benchmarks
+def compare(results, baseline, tolerance):
+    def key(entry):
+        return tuple(entry.get(name) for name in KEY_FIELDS)
+    # the fastest repeat is the least noisy number to compare
+    previous = {key(entry): entry for entry in baseline['results'] if 'seconds_min' in entry}
+    regressions = []
+    for entry in results:
+        old = previous.get(key(entry))
+        if old is None or 'seconds_min' not in entry:
+            continue
+        ratio = entry['seconds_min'] / old['seconds_min']
+        entry['baseline_ratio'] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append(entry)
+    return regressions
+
+# imports that took longer than the budget or loaded a heavy module
+def check_imports(results, budget):
+    return [entry for entry in results
+            if entry['name'] == 'import' and (entry['seconds_min'] > budget or entry['heavy_modules'])]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the simulation and write the timings as JSON.")
+    parser.add_argument('--sizes', nargs='+', type=int, default=[50, 100, 200, 500, 1000])
+    parser.add_argument('--radii', nargs='+', type=int, default=[0, 1, 2, 5])
+    parser.add_argument('--engines', nargs='+', choices=['object', 'vectorized', 'parallel'], default=['object', 'vectorized'])
+    parser.add_argument('--dynamic', choices=DYNAMICS, default='replicator',
+                        help='dynamic used for the run_iteration sweep')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--replicas', type=int, default=32, help='replicas in the ensemble benchmarks')
+    parser.add_argument('--max-object-size', type=int, default=100,
+                        help='largest grid the object engine is timed on')
+    parser.add_argument('--max-cell-neighbors', type=float, default=3e7,
+                        help='skip configurations with more than this many size^2 * neighbors')
+    parser.add_argument('--baseline', default=None, help='earlier output to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown against the baseline before it counts as a regression')
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET,
+                        help='seconds the simulation core may take to import in a new interpreter')
+    parser.add_argument('--imports-only', action='store_true',
+                        help='only time the imports, the exit status is 1 if one is over the budget')
+    parser.add_argument('--output', default=None, help='file for the JSON results (default: stdout)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmarks(args)
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'repeats': args.repeats
+        },
+        'results': results
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        report['regressions'] = len(regressions)
+    over_budget = check_imports(results, args.import_budget)
+    report['imports_over_budget'] = len(over_budget)
+
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    for entry in regressions:
+        key = {name: entry[name] for name in KEY_FIELDS if entry.get(name) is not None}
+        print(f"regression: {key} is {entry['baseline_ratio']:.2f}x the baseline", file=sys.stderr)
+    for entry in over_budget:
+        print(f"import of {entry['module']} took {entry['seconds_min']:.3f}s (budget {args.import_budget}s)"
+              + (f" and loaded {', '.join(entry['heavy_modules'])}" if entry['heavy_modules'] else ""),
+              file=sys.stderr)
+    return 1 if regressions or over_budget else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
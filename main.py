@@ -5,25 +5,34 @@ through a heat diagram and a graph.
 '''
 
 import os
-import datetime
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from simulation import Simulation, SpatialConfig
 from sim.game import GameType
 from sim.dynamics import LearningDynamic
-from matplotlib.colors import to_rgb
-from matplotlib.patches import Patch
-import tkinter as tk
-from tkinter import ttk
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.figure import Figure
-from sim.game import GameType
-import json
+from sim.results import make_output_dir, save_config
+from sim.metrics import MetricsWriter
+from sim.render import GridRenderer
+from sim.worker import SimulationWorker
+from sim.stability import StabilityDetector
+from sim.recording import Recorder, Recording
+from sim.profiling import timed
+
+# tkinter and matplotlib are only loaded once a window is opened, so that importing main (e.g.
+# for the simulation classes) stays as fast as importing the simulation core
+tk = ttk = filedialog = FigureCanvasTkAgg = Figure = Patch = None
+
+def load_gui_modules():
+    global tk, ttk, filedialog, FigureCanvasTkAgg, Figure, Patch
+    import tkinter as tk
+    from tkinter import ttk, filedialog
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    from matplotlib.figure import Figure
+    from matplotlib.patches import Patch
 
 # defines methods necessary for creating GUI
 class SimulationGUI:
     def __init__(self, master):
+        load_gui_modules()
         self.master = master
         master.title("GTP")
         
@@ -32,14 +41,24 @@ class SimulationGUI:
         self.should_stop = False
         self.save_data = tk.BooleanVar(value=False)
         self.current_game = GameType.PD
-        self.metrics = []
+        self.metrics_writer = None
         self.output_dir = None
-        
-        # stability tracking
+        self.record_data = tk.BooleanVar(value=False)
+        self.profile_data = tk.BooleanVar(value=False)
+        self.recorder = None
+        self.replay = None
+        self.worker = None
+        # the display is refreshed at about 30 frames per second, the chart every few frames
+        self.frame_interval = 33
+        self.chart_every = 5
+        self.frame_count = 0
+        
+        # stability tracking, settings can be changed in the stability panel
         self.stability_range = 30
         self.stability_iterations = 50
-        self.strategy_history = {}
-        self.stability_reached = False
+        self.stability_relative = tk.BooleanVar(value=False)
+        self.stop_when_stable = tk.BooleanVar(value=False)
+        self.stability = None
         
         # layout
         self.create_controls()
@@ -119,9 +138,43 @@ class SimulationGUI:
         
         self.update_payoff_controls()
 
+        # stability
+        self.stability_frame = ttk.LabelFrame(control_frame, text="Stability", padding=10)
+        self.stability_frame.pack(pady=10, fill=tk.X)
+        range_row = ttk.Frame(self.stability_frame)
+        range_row.pack(fill=tk.X)
+        ttk.Label(range_row, text="Range:").pack(side=tk.LEFT)
+        self.stability_range_entry = ttk.Entry(range_row, width=8)
+        self.stability_range_entry.insert(0, str(self.stability_range))
+        self.stability_range_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(range_row, text="% of agents",
+                        variable=self.stability_relative).pack(side=tk.LEFT)
+        window_row = ttk.Frame(self.stability_frame)
+        window_row.pack(fill=tk.X)
+        ttk.Label(window_row, text="Iterations:").pack(side=tk.LEFT)
+        self.stability_iterations_entry = ttk.Entry(window_row, width=8)
+        self.stability_iterations_entry.insert(0, str(self.stability_iterations))
+        self.stability_iterations_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(self.stability_frame, text="Stop when stable",
+                        variable=self.stop_when_stable).pack(anchor=tk.W)
+        self.stability_status = ttk.Label(self.stability_frame, text="", foreground="green")
+        self.stability_status.pack()
+
         # save data
         ttk.Checkbutton(control_frame, text="Save Metrics", 
                        variable=self.save_data).pack(pady=5)
+        ttk.Checkbutton(control_frame, text="Record Trajectory", 
+                       variable=self.record_data).pack(pady=5)
+        ttk.Button(control_frame, text="Replay Recording...", 
+                   command=self.open_replay).pack(pady=5, fill=tk.X)
+
+        # timing of the phases of an iteration, filled in while running with profiling on
+        self.timing_frame = ttk.LabelFrame(control_frame, text="Timing", padding=10)
+        self.timing_frame.pack(pady=10, fill=tk.X)
+        ttk.Checkbutton(self.timing_frame, text="Profile Phases",
+                        variable=self.profile_data).pack(anchor=tk.W)
+        self.timing_label = ttk.Label(self.timing_frame, text="", font=("Courier", 9), justify=tk.LEFT)
+        self.timing_label.pack(anchor=tk.W)
         self.save_status_label = ttk.Label(control_frame, text="", foreground="green")
         self.save_status_label.pack(pady=5)
         self.save_status_label = ttk.Label(
@@ -285,8 +338,21 @@ class SimulationGUI:
         self.canvas = FigureCanvasTkAgg(self.fig, master=map_frame)
         self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
         
-        self.img = self.ax.imshow(np.zeros((50, 50, 3)), interpolation='nearest')
+        self.img = self.ax.imshow(np.zeros((50, 50, 3), dtype=np.uint8), interpolation='nearest')
         self.ax.axis('off')
+        self.renderer = GridRenderer(self.canvas, self.ax, self.img)
+        
+        # iteration counter, a label is much cheaper to update every frame than text in the figure
+        self.iteration_label = ttk.Label(map_frame, text="Iteration: 0", font=("Courier", 12))
+        self.iteration_label.pack(side=tk.BOTTOM, anchor=tk.E, padx=5)
+        
+        # replay controls, only shown while a recording is open
+        self.replay_frame = ttk.Frame(map_frame)
+        self.replay_scale = ttk.Scale(self.replay_frame, from_=0, to=0, orient=tk.HORIZONTAL,
+                                      command=self.on_replay_seek)
+        self.replay_scale.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        ttk.Button(self.replay_frame, text="Exit Replay", 
+                   command=self.close_replay).pack(side=tk.RIGHT)
         
         # strategy count chart (right)
         chart_frame = ttk.Frame(viz_container)
@@ -308,6 +374,8 @@ class SimulationGUI:
         self.chart_ax.grid(True)
     # starts the simulation with the given game configurations
     def start_simulation(self):
+        if self.replay is not None:
+            self.close_replay()
         if not self.is_running:
             if not hasattr(self, 'current_iteration') or self.should_stop:
                 self.current_iteration = 0
@@ -319,60 +387,153 @@ class SimulationGUI:
             selected_game = self.game_selector.get()
             self.current_game = next(gt for gt in GameType if gt.name == selected_game)
             
-            self.master.after(100, self.run_simulation_loop)
-    # loop for each iteration of the simulation
-    def run_simulation_loop(self):
-        if not hasattr(self, 'current_iteration'):
-            self.current_iteration = 0
-        
-        if self.should_stop:
-            self.stop_simulation()
-            return
-            
-        self.sim.run_iteration()
+            # the simulation steps on a background thread, the display only samples it. Tk
+            # variables must not be read from that thread
+            self.saving = self.save_data.get()
+            self.stability = self.create_stability_detector()
+            self.stopping_when_stable = self.stop_when_stable.get()
+            self.sim.set_profiling(self.profile_data.get())
+            if self.record_data.get():
+                self.output_dir = make_output_dir(self.current_game)
+                self.recorder = Recorder(os.path.join(self.output_dir, "trajectory.gtprec"), self.sim)
+            self.worker = SimulationWorker(self.sim, on_iteration=self.record_iteration)
+            self.worker.start()
+            self.master.after(self.frame_interval, self.refresh_display)
+    # builds the stability detector from the stability panel, keeping the previous settings if
+    # an entry is invalid
+    def create_stability_detector(self):
+        try:
+            stability_range = float(self.stability_range_entry.get())
+            stability_iterations = int(self.stability_iterations_entry.get())
+            if stability_range < 0 or stability_iterations < 1:
+                raise ValueError
+            self.stability_range = stability_range
+            self.stability_iterations = stability_iterations
+            self.stability_status.config(text="")
+        except ValueError:
+            self.stability_status.config(text="Invalid stability settings", foreground="red")
+        # a relative range is entered as a percentage, like the strategy distribution
+        relative = self.stability_relative.get()
+        stability_range = self.stability_range / 100 if relative else self.stability_range
+        return StabilityDetector(stability_range, self.stability_iterations,
+                                 relative=relative, population=self.sim.config.size ** 2)
+    # called on the worker thread after each iteration of the simulation, returns True to stop it
+    def record_iteration(self, sim):
         self.current_iteration += 1
+        if self.recorder is not None:
+            self.recorder.record(sim)
         
-        # collect data if saving is enabled
-        if self.save_data.get():
-            game_config = self.current_game.value
-            strategy_counts = {strat.name: 0 for strat in game_config.strategies}
-            for row in self.sim.grid:
-                for agent in row:
-                    strategy_counts[agent.strategy.name] += 1
-            
-            self.metrics.append({
-                'iteration': self.current_iteration,
-                **strategy_counts
-            })
-            
-            # update strategy history for stability detection
-            for strat in strategy_counts:
-                self.strategy_history[strat].append(strategy_counts[strat])
-                if len(self.strategy_history[strat]) > self.stability_iterations:
-                    self.strategy_history[strat].pop(0)
-            
-            # check for stability
-            if all(len(history) == self.stability_iterations for history in self.strategy_history.values()) and not self.stability_reached:
-                is_stable = all(max(history) - min(history) <= self.stability_range for history in self.strategy_history.values())
-                if is_stable:
-                    print(f"Stability reached at iteration {self.current_iteration}")
-                    self.stability_reached = True
-        
-        self.update_grid()
-        self.iteration_text.set_text(f'Iteration: {self.current_iteration}')
+        # counts are maintained by the simulation, reading them does not visit the agents
+        strategy_counts = sim.strategy_counts()
         
-        self.master.after(50, self.run_simulation_loop)
+        # collect data if saving is enabled
+        if self.saving:
+            # metrics are streamed to the output directory while the simulation runs
+            if self.metrics_writer is None:
+                if self.output_dir is None:
+                    self.output_dir = make_output_dir(self.current_game)
+                self.metrics_writer = MetricsWriter(os.path.join(self.output_dir, "metrics.csv"))
+            with timed(sim.profiler, 'metrics'):
+                self.metrics_writer.append({
+                    'iteration': self.current_iteration,
+                    **strategy_counts
+                })
+        
+        # stability is checked whether or not metrics are saved
+        was_stable = self.stability.reached
+        stable = self.stability.update(strategy_counts)
+        if stable and not was_stable:
+            print(f"Stability reached at iteration {self.current_iteration}")
+        return stable and self.stopping_when_stable
+    # draws the latest state published by the worker at a fixed frame rate, older frames are dropped
+    def refresh_display(self):
+        if not self.is_running:
+            return
+        snapshot = self.worker.latest()
+        if snapshot is not None:
+            with timed(self.sim.profiler, 'render'):
+                self.show_snapshot(snapshot)
+        if self.frame_count % self.chart_every == 0:
+            self.update_timing()
+        if not self.worker.running:
+            # the worker stopped on its own, after reaching stability
+            if self.stability.reached:
+                self.stability_status.config(
+                    text=f"Stable at iteration {self.current_iteration}", foreground="green")
+            self.stop_simulation()
+            return
+        self.master.after(self.frame_interval, self.refresh_display)
+    # shows the rolling timing of each phase in the timing panel
+    def update_timing(self):
+        if self.sim.profiler is None:
+            self.timing_label.config(text="")
+            return
+        self.timing_label.config(text=self.sim.profiler.report())
+    # draws one snapshot of the simulation
+    def show_snapshot(self, snapshot):
+        self.iteration_label.config(text=f'Iteration: {snapshot.iteration}')
+        self.update_grid(snapshot)
     # stop the iterations of the simulation
     def stop_simulation(self):
         self.should_stop = True
+        was_running = self.is_running
         self.is_running = False
         self.btn_run.config(state=tk.NORMAL)
         self.btn_stop.config(state=tk.DISABLED)
         
+        # the worker finishes its current iteration, then the final state is shown
+        if self.worker is not None:
+            self.worker.stop()
+            snapshot = self.worker.latest()
+            self.worker = None
+            if snapshot is not None and was_running:
+                self.show_snapshot(snapshot)
+                self.update_timing()
+        
         # save data if enabled
-        if self.save_data.get() and self.metrics:
+        if self.metrics_writer is not None:
             self.save_simulation_data()
-            self.metrics = []  # clear metrics after saving
+            self.metrics_writer = None
+        if self.recorder is not None:
+            self.recorder.close()
+            print(f"Trajectory of {self.recorder.count} frames saved to {self.recorder.path}")
+            self.recorder = None
+        self.output_dir = None
+    # opens a recording and shows its frames with a slider, without running the simulation
+    def open_replay(self):
+        path = filedialog.askopenfilename(
+            initialdir="results",
+            filetypes=[("Recordings", "*.gtprec"), ("All files", "*")])
+        if not path:
+            return
+        try:
+            recording = Recording(path)
+        except (OSError, ValueError) as e:
+            self.save_status_label.config(text=f"Cannot open recording: {e}", foreground="red")
+            return
+        self.stop_simulation()
+        self.replay = recording
+        header = recording.header
+        self.renderer.set_palette(header['strategies'], header['strategy_colors'])
+        self.ax.legend(handles=[Patch(facecolor=header['strategy_colors'][name], label=name)
+                                for name in header['strategies']], loc='upper right')
+        self.renderer.invalidate()
+        self.replay_scale.configure(to=len(recording) - 1)
+        self.replay_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        self.replay_scale.set(0)
+        self.on_replay_seek(0)
+    # draws the frame under the replay slider
+    def on_replay_seek(self, value):
+        if self.replay is None:
+            return
+        i = int(float(value))
+        self.iteration_label.config(text=f'Iteration: {self.replay.iteration(i)}')
+        self.renderer.draw(self.replay[i])
+    # leaves replay mode and goes back to the current simulation
+    def close_replay(self):
+        self.replay = None
+        self.replay_frame.pack_forget()
+        self.reset_simulation()
     # stops and resets the simulation to initial game state for current configurations    
     def reset_simulation(self):
         self.stop_simulation()
@@ -382,8 +543,6 @@ class SimulationGUI:
     # initiatez the simulation based on the game configurations
     def initialize_simulation(self):
         game_config = self.current_game.value
-        if hasattr(self, 'iteration_text'):
-            self.iteration_text.remove()
 
         strategy_dist = getattr(self, 'custom_distribution', None)
         if strategy_dist is None:
@@ -417,11 +576,11 @@ class SimulationGUI:
             for agent in self.sim.grid.flatten():
                 agent.score = 0
                 agent.prev_score = 0
+            self.sim.recount()
 
         # legend
         game_config = self.current_game.value
-        self.strategy_history = {strat.name: [] for strat in game_config.strategies}
-        self.stability_reached = False
+        self.stability = None
 
         # create legend
         legend_elements = [
@@ -430,17 +589,10 @@ class SimulationGUI:
         ]
         self.ax.legend(handles=legend_elements, loc='upper right')
         
-        # iteration counter
-        self.iteration_text = self.ax.text(
-            0.95, 0.05,
-            'Iteration: 0',
-            horizontalalignment='right',
-            verticalalignment='bottom',
-            transform=self.ax.transAxes,
-            color='white',
-            fontsize=12,
-            bbox=dict(facecolor='black', alpha=0.5)
-        )
+        self.iteration_label.config(text='Iteration: 0')
+        self.renderer.set_colors(game_config)
+        # the legend changed, the next frame redraws the whole map
+        self.renderer.invalidate()
         
         # initialize strategy data for the chart
         self.strategy_data = {strat.name: [] for strat in game_config.strategies}
@@ -462,68 +614,34 @@ class SimulationGUI:
         self.chart_ax.legend(loc='upper right')
         self.chart_canvas.draw()
     # updates the grid base don updated values for each agent/strategy after each iteration of the simulation
-    def update_grid(self):
-        game_config = self.current_game.value
-        
-        self.img.set_data(np.zeros((50, 50, 3)))
-        
-        grid = np.array([
-            to_rgb(game_config.strategy_colors[agent.strategy.name]) 
-            for agent_row in self.sim.grid 
-            for agent in agent_row]).reshape(self.sim.grid.shape[0], self.sim.grid.shape[1], 3)
-        
-        self.img.set_data(grid)
-        self.canvas.draw_idle()
+    def update_grid(self, snapshot=None):
+        # only the map is redrawn
+        if snapshot is None:
+            self.renderer.draw(self.sim.strategy_grid())
+            return
+        self.renderer.draw(snapshot.strategies)
         
         # update strategy count chart
-        if self.is_running:
-            # count strategies
-            strategy_counts = {strat.name: 0 for strat in game_config.strategies}
-            total_agents = 0
-            
-            for row in self.sim.grid:
-                for agent in row:
-                    strategy_counts[agent.strategy.name] += 1
-                    total_agents += 1
-            
-            # calculate proportions
-            for strat_name, count in strategy_counts.items():
-                proportion = count / total_agents if total_agents > 0 else 0
-                self.strategy_data[strat_name].append(proportion)
-                
-                # update the line data
-                self.strategy_lines[strat_name].set_data(
-                    range(len(self.strategy_data[strat_name])), 
-                    self.strategy_data[strat_name]
-                )
-            
-            self.chart_ax.set_xlim(0, max(10, len(self.strategy_data[list(self.strategy_data.keys())[0]])))
+        total_agents = snapshot.strategies.size
+        for strat_name, count in snapshot.counts.items():
+            proportion = count / total_agents if total_agents > 0 else 0
+            self.strategy_data[strat_name].append((snapshot.iteration, proportion))
+        
+        # the chart is slower to draw than the map, so it is refreshed less often
+        self.frame_count += 1
+        if self.frame_count % self.chart_every == 0 or not self.is_running:
+            for strat_name, points in self.strategy_data.items():
+                iterations, proportions = zip(*points)
+                self.strategy_lines[strat_name].set_data(iterations, proportions)
+            self.chart_ax.set_xlim(0, max(10, snapshot.iteration))
             self.chart_canvas.draw_idle()
     # saves the data of the simulation into a file in 'results' directory
     def save_simulation_data(self):
-        # create output directory with timestamp
-        date_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        dir_name = f"{date_str}_{self.current_game.name}"
-        self.output_dir = os.path.join("results", dir_name)
-        os.makedirs(self.output_dir, exist_ok=True)
-        
-        # save metrics to csv
-        metrics_df = pd.DataFrame(self.metrics)
-        metrics_df.to_csv(os.path.join(self.output_dir, "metrics.csv"), index=False)
-        
-        # save configuration
-        config = {
-            'game_type': self.current_game.name,
-            'grid_size': self.sim.grid.shape[0],
-            'radius': self.sim.config.radius,
-            'mobility': self.sim.config.mobility,
-            'topology': self.sim.config.topology,
-            'total_iterations': self.current_iteration,
-            'strategy_distribution': self.sim.config.strategy_distribution
-        }
-        
-        with open(os.path.join(self.output_dir, "config.json"), 'w') as f:
-            json.dump(config, f, indent=4)
+        self.metrics_writer.close()
+        save_config(self.output_dir, self.current_game, self.sim, self.current_iteration,
+                    dynamic=self.dynamic_selector.get())
+        if self.sim.profiler is not None:
+            self.sim.profiler.to_json(os.path.join(self.output_dir, "profile.json"))
 
         save_text = f"Metrics saved to: {self.output_dir}"
         self.save_status_label.config(text=save_text, foreground="green")
@@ -537,6 +655,7 @@ class SimulationGUI:
         self.master.destroy()
 
 if __name__ == "__main__":
+    load_gui_modules()
     root = tk.Tk()
     gui = SimulationGUI(root)
     root.protocol("WM_DELETE_WINDOW", gui.on_closing)
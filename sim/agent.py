@@ -3,10 +3,13 @@ agent.py contains the structure neccesary to assign attibures to each agent.
 """
 
 class Agent:
-    def __init__(self, strategy, position, gender=None):
+    __slots__ = ('strategy', 'score', 'history', 'position', 'type', 'prev_score')
+
+    def __init__(self, strategy, position, gender=None, history=None):
         self.strategy = strategy
         self.score = 0
-        self.history = []
+        # list of (my_action, their_action), or a bounded History from sim/history.py
+        self.history = [] if history is None else history
         self.position = position
         self.type = gender
         self.prev_score = 0
@@ -0,0 +1,171 @@
+"""
+checkpoint.py saves the full state of a Simulation to a compressed .npz file and restores it
+exactly, so that a long run can be interrupted and resumed with the same results it would have
+had without the interruption. The file holds the per-cell arrays (strategy ids, types, scores,
+previous scores, interaction histories) and a JSON header with the iteration counter, the
+SpatialConfig, the payoff matrix and the state of every random number generator in use.
+"""
+
+import dataclasses
+import json
+import os
+import random
+import numpy as np
+from simulation import Simulation, SpatialConfig
+from sim.game import GameType
+from sim.dynamics import LearningDynamic
+
+FORMAT_VERSION = 1
+
+def save_checkpoint(sim, path):
+    arrays = _population_arrays(sim)
+    np_state = np.random.get_state()
+    header = {
+        'version': FORMAT_VERSION,
+        'game_type': sim.game_type.name,
+        'dynamic': sim.dynamic.__name__,
+        'agent_types': list(sim.agent_types),
+        'engine': sim.engine_name,
+        'seed': sim.seed,
+        # the parallel engine draws from streams derived from (entropy, tile, iteration)
+        'tiles': getattr(sim.engine, 'tiles', None),
+        'entropy': str(sim.engine.entropy) if sim.engine_name == 'parallel' else None,
+        'active_set': bool(getattr(sim.engine, 'active_set', False)),
+        'schedule': getattr(sim.engine, 'schedule', 'synchronous'),
+        'update_events': sim.update_events(),
+        'iteration': sim.iteration,
+        'config': {
+            'size': sim.config.size,
+            'radius': sim.config.radius,
+            'mobility': sim.config.mobility,
+            'topology': sim.config.topology,
+            'strategy_distribution': sim.config.strategy_distribution,
+            'matching': sim.config.matching,
+            'payoff_mode': sim.config.payoff_mode,
+        },
+        'payoff_matrix': [[a1, a2, p1, p2] for (a1, a2), (p1, p2) in sim.game_config.payoff_matrix.items()],
+        # the module level generators are used by the object path and by strategies that pick
+        # their action at random, the engine has its own Generator
+        'random_state': random.getstate(),
+        'numpy_state': [np_state[0], int(np_state[2]), int(np_state[3]), float(np_state[4])],
+        'engine_rng': None if sim.engine is None else sim.engine.rng.bit_generator.state,
+    }
+    arrays['numpy_key'] = np_state[1]
+    # the event schedule draws from its frontier by position, so the order is part of the state
+    scheduler = getattr(sim.engine, 'scheduler', None)
+    if hasattr(scheduler, 'frontier') and sim.engine.population.touched == []:
+        arrays['frontier'] = np.array(scheduler.frontier.cells, dtype=np.intp)
+    arrays['header'] = np.frombuffer(json.dumps(header).encode(), dtype=np.uint8)
+    # written next to the target and renamed, so an interruption never leaves half a checkpoint
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(temporary, path)
+
+# a new Simulation in the saved state. dynamic is only needed for a learning dynamic that is not
+# one of LearningDynamic's
+def load_checkpoint(path, dynamic=None):
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files}
+    header = json.loads(arrays['header'].tobytes().decode())
+    if header['version'] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {header['version']}")
+
+    game_type = GameType[header['game_type']]
+    # the saved payoffs only apply to this simulation, the game itself is left as it is
+    payoff_matrix = {(a1, a2): (p1, p2) for a1, a2, p1, p2 in header['payoff_matrix']}
+    game_config = dataclasses.replace(game_type.value, payoff_matrix=payoff_matrix)
+    if dynamic is None:
+        dynamic = getattr(LearningDynamic, header['dynamic'])
+    sim = Simulation(game_type, SpatialConfig(**header['config']), dynamic, header['agent_types'],
+                     engine=header['engine'], seed=header['seed'], tiles=header.get('tiles'),
+                     active_set=header.get('active_set', False),
+                     schedule=header.get('schedule', 'synchronous'), game_config=game_config)
+    _restore_population(sim, arrays)
+    sim.iteration = header['iteration']
+    sim.recount()
+
+    version, key, gauss = header['random_state']
+    random.setstate((version, tuple(key), gauss))
+    name, pos, has_gauss, cached_gaussian = header['numpy_state']
+    np.random.set_state((name, arrays['numpy_key'], pos, has_gauss, cached_gaussian))
+    if sim.engine is not None:
+        sim.engine.rng.bit_generator.state = header['engine_rng']
+    if header.get('update_events') is not None:
+        sim.engine.scheduler.events = header['update_events']
+    if 'frontier' in arrays:
+        for cell in arrays['frontier'].tolist():
+            sim.engine.scheduler.frontier.add(cell)
+        sim.engine.population.touched = []
+    if header['engine'] == 'parallel':
+        sim.engine.iteration = header['iteration']
+        sim.engine.entropy = int(header['entropy'])
+    return sim
+
+# per-cell arrays. histories are stored as ring buffers: the last `length` entries of a row end
+# just before `head`
+def _population_arrays(sim):
+    if sim.engine is not None:
+        pop = sim.engine.population
+        return {
+            'strategies': pop.strategies.copy(),
+            'types': pop.types.copy(),
+            'scores': pop.scores.copy(),
+            'prev_scores': pop.prev_scores.copy(),
+            'history_own': pop.histories.own.copy(),
+            'history_opp': pop.histories.opp.copy(),
+            'history_head': pop.histories.head.copy(),
+            'history_length': pop.histories.length.copy(),
+        }
+    agents = sim.grid.ravel()
+    n = len(agents)
+    width = max(sim.history_depth, 1)
+    arrays = {
+        'strategies': sim.strategy_grid().ravel().astype(np.int8),
+        'types': sim.type_ids().astype(np.int8),
+        'scores': np.array([agent.score for agent in agents], dtype=float),
+        'prev_scores': np.array([agent.prev_score for agent in agents], dtype=float),
+        'history_own': np.full((n, width), -1, dtype=np.int8),
+        'history_opp': np.full((n, width), -1, dtype=np.int8),
+        'history_head': np.zeros(n, dtype=np.int16),
+        'history_length': np.zeros(n, dtype=np.int16),
+    }
+    for cell, agent in enumerate(agents):
+        history = agent.history
+        if history.depth == 0:
+            continue
+        arrays['history_own'][cell] = history.own
+        arrays['history_opp'][cell] = history.opp
+        arrays['history_head'][cell] = (history.start + history.length) % history.depth
+        arrays['history_length'][cell] = history.length
+    return arrays
+
+def _restore_population(sim, arrays):
+    if sim.engine is not None:
+        pop = sim.engine.population
+        if not np.array_equal(pop.types, arrays['types']):
+            raise ValueError("Checkpoint does not match the agent type layout")
+        pop.strategies[:] = arrays['strategies']
+        pop.scores[:] = arrays['scores']
+        pop.prev_scores[:] = arrays['prev_scores']
+        pop.histories.own[:] = arrays['history_own']
+        pop.histories.opp[:] = arrays['history_opp']
+        pop.histories.head[:] = arrays['history_head']
+        pop.histories.length[:] = arrays['history_length']
+        return
+    strategies = sim.game_config.strategies
+    type_names = sim.agent_types if len(sim.agent_types) > 1 else [None]
+    for cell, agent in enumerate(sim.grid.ravel()):
+        agent.strategy = strategies[arrays['strategies'][cell]]
+        agent.type = type_names[arrays['types'][cell]]
+        agent.score = arrays['scores'][cell].item()
+        agent.prev_score = arrays['prev_scores'][cell].item()
+        history = agent.history
+        if history.depth == 0:
+            continue
+        history.own[:] = type(history.own)('b', arrays['history_own'][cell].tobytes())
+        history.opp[:] = type(history.opp)('b', arrays['history_opp'][cell].tobytes())
+        history.length = int(arrays['history_length'][cell])
+        history.start = (int(arrays['history_head'][cell]) - history.length) % history.depth
+    # the spare grid is rebuilt from the restored agents on the next iteration
+    sim.grid = sim.grid
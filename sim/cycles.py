@@ -0,0 +1,115 @@
+"""
+cycles.py detects when the strategy grid returns to a state it was in before. Each iteration's
+strategy array is hashed and kept in a bounded table, and a hit reports a fixed point (period 1)
+or a cycle of period p together with the iteration where it started.
+
+A repeat only proves that the run will keep cycling when the next state depends on nothing but
+the strategy grid. Partners are drawn at random and scores accumulate in every mode of this
+simulation, so a repeat on its own is reported as stochastic. The exception is an absorbing
+state: when no agent has a neighbor it could learn from with a different strategy, the built-in
+(imitation) dynamics can never change the grid again, whatever the random draws are.
+"""
+
+import hashlib
+from collections import deque
+import numpy as np
+
+# dynamics that only ever copy the strategy of the agent itself or of one of its neighbors
+IMITATION_DYNAMICS = ('replicator', 'fermi', 'moran', 'random_copy', 'aspiration')
+
+def state_hash(strategies):
+    data = np.ascontiguousarray(strategies)
+    return hashlib.blake2b(memoryview(data).cast('B'), digest_size=16).digest()
+
+# true when the strategy grid of sim cannot change anymore under its learning dynamic
+def is_absorbing(sim):
+    if getattr(sim.dynamic, '__name__', None) not in IMITATION_DYNAMICS:
+        return False
+    strategies = sim.strategy_grid().ravel()
+    types = sim.type_ids()
+    if sim.config.radius < 1:
+        # well mixed: every agent learns from the whole population of its type
+        return len(np.unique(types)) == len(np.unique(types.astype(np.int64) * 256 + strategies))
+    window = getattr(sim.engine, 'window', None)
+    if window is not None:
+        # neighbors of the same type playing the agent's own strategy, without a neighbor table
+        own = np.zeros(len(strategies))
+        for s in np.unique(strategies):
+            playing = strategies == s
+            own[playing] = window.same_type_sum(playing.astype(float))[playing]
+        return not (window.same_counts - np.rint(own) > 0).any()
+    table = sim.neighbor_table
+    differs = strategies[table.indices] != strategies[:, None]
+    learn = table.mask(types[table.indices] == types[:, None])
+    if learn is not None:
+        differs &= learn
+    return not differs.any()
+
+# a repeated state: the grid at `start + period` equals the grid at `start`
+class Repeat:
+    def __init__(self, start, period, deterministic):
+        self.start = start
+        self.period = period
+        # True when the run is certain to stay in this cycle
+        self.deterministic = deterministic
+
+    @property
+    def fixed_point(self):
+        return self.period == 1
+
+    def as_dict(self):
+        return {'start': self.start, 'period': self.period, 'deterministic': self.deterministic}
+
+    def __repr__(self):
+        kind = 'fixed point' if self.fixed_point else f'cycle of period {self.period}'
+        return f"{kind} from iteration {self.start} ({'deterministic' if self.deterministic else 'stochastic'})"
+
+class CycleDetector:
+    # capacity is the number of recent states kept, i.e. the longest period that can be found
+    def __init__(self, capacity=256):
+        if capacity < 1:
+            raise ValueError("A cycle detector needs to keep at least one state")
+        self.capacity = capacity
+        self.seen = {}
+        self.recent = deque()
+        # strategy counts of the kept iterations and the one before them, so that the counts of a
+        # repeat's start are still there when it is matched as the oldest kept state. used to
+        # extrapolate a confirmed cycle
+        self.counts = {}
+        # first repeat found, and the confirmed one once there is one
+        self.repeat = None
+        self.confirmed = None
+
+    # record the state after `iteration`. returns a Repeat when the state was seen before, which
+    # is stochastic until confirmed
+    def update(self, iteration, strategies, counts=None):
+        key = state_hash(strategies)
+        previous = self.seen.get(key)
+        if len(self.recent) == self.capacity:
+            old_iteration, old_key = self.recent.popleft()
+            if self.seen.get(old_key) == old_iteration:
+                del self.seen[old_key]
+        self.seen[key] = iteration
+        self.recent.append((iteration, key))
+        if counts is not None:
+            self.counts[iteration] = counts
+            while len(self.counts) > self.capacity + 1:
+                del self.counts[next(iter(self.counts))]
+        if previous is None:
+            return None
+        repeat = Repeat(previous, iteration - previous, False)
+        if self.repeat is None:
+            self.repeat = repeat
+        return repeat
+
+    # mark a repeat as certain to continue, e.g. after is_absorbing
+    def confirm(self, repeat):
+        repeat.deterministic = True
+        self.confirmed = repeat
+
+    # strategy counts at a later iteration, from the confirmed cycle
+    def predict(self, iteration):
+        cycle = self.confirmed
+        if cycle is None or iteration < cycle.start:
+            raise ValueError("No confirmed cycle to extrapolate from")
+        return self.counts[cycle.start + (iteration - cycle.start) % cycle.period]
@@ -1,10 +1,21 @@
 """
 dynamics.py contains the definitions for the learning dynamics applied to eacj agent.
 These dynamics will affect the agent's startegy based on game state or randomly.
+
+LearningDynamic works on one agent and its list of neighbors. BatchedLearningDynamic has the
+same rules for the whole population at once, working on score and strategy arrays.
+WindowedLearningDynamic has them once more for large neighborhoods, where the rules read the
+neighborhood through a Window (see window.py) instead of a neighbor table.
 """
 
+import math
 import random
 import numpy as np
+from sim.neighborhood import pick_columns, pick_neighbors
+
+# neighbors that can be imitated, i.e. of the same type as the agent
+def _same_type(agent, neighbors):
+    return [neighbor for neighbor in neighbors if neighbor.type == agent.type]
 
 class LearningDynamic:
 
@@ -12,9 +23,7 @@ class LearningDynamic:
     def replicator(agent, neighbors):
         if not neighbors:
             return agent.strategy
-        for neighbor in neighbors.copy():
-            if agent.type != neighbor.type:
-                neighbors.remove(neighbor)
+        neighbors = _same_type(agent, neighbors)
         best = max(neighbors, key=lambda n: n.score)
         return best.strategy if best.score > agent.score else agent.strategy
 
@@ -22,49 +31,178 @@ class LearningDynamic:
     def fermi(agent, neighbors, beta=0.1):
         if not neighbors:
             return agent.strategy
-        for neighbor in neighbors.copy():
-            if agent.type != neighbor.type:
-                neighbors.remove(neighbor)
+        neighbors = _same_type(agent, neighbors)
         other = random.choice(neighbors)
         delta = other.score - agent.score
-        if delta > 0 or random.random() < np.exp(beta * delta):
+        if delta > 0 or random.random() < math.exp(beta * delta):
             return other.strategy
         return agent.strategy
-    
+
     # probability of choosing strategy proportional to fitness
     def moran(agent, neighbors):
-        for neighbor in neighbors.copy():
-            if agent.type != neighbor.type:
-                neighbors.remove(neighbor)
-        candidate_pool = [agent] + neighbors
-        total_payoff = sum(max(c.score, 0) for c in candidate_pool)
-        
-        if total_payoff <= 0:
+        candidate_pool = [agent] + _same_type(agent, neighbors)
+        weights = [max(c.score, 0) for c in candidate_pool]
+
+        if sum(weights) <= 0:
             chosen = random.choice(candidate_pool)
         else:
-            probabilities = [max(c.score/total_payoff, 0) for c in candidate_pool]
-            chosen = np.random.choice(candidate_pool, p=probabilities)
+            chosen = random.choices(candidate_pool, weights=weights)[0]
         return chosen.strategy
-    
+
     # random
     def random_copy(agent, neighbors):
         if not neighbors:
             return agent.strategy
-        for neighbor in neighbors.copy():
-            if agent.type != neighbor.type:
-                neighbors.remove(neighbor)
+        neighbors = _same_type(agent, neighbors)
         other = random.choice(neighbors)
         return other.strategy
-    
+
     # threshold driven random strategy adoption
     def aspiration(agent, neighbors):
         if not neighbors:
             return agent.strategy
-        for neighbor in neighbors.copy():
-            if agent.type != neighbor.type:
-                neighbors.remove(neighbor)
-        
-        avg_payoff = np.mean([n.score for n in neighbors]) if neighbors else 0
+        neighbors = _same_type(agent, neighbors)
+
+        avg_payoff = sum(n.score for n in neighbors) / len(neighbors) if neighbors else 0
         if agent.score < avg_payoff:
             return random.choice(neighbors).strategy
-        return agent.strategy
\ No newline at end of file
+        return agent.strategy
+
+# the batched rules take the scores and strategy ids of the whole population, an (n, k) table
+# of the cells each agent learns from, a mask of which of those are valid (same type, inside the
+# grid; None when all are) and a NumPy Generator. they return the new strategy ids. pool_scores,
+# when given, are the scores of the pool as each agent sees them, instead of scores[pool]
+class BatchedLearningDynamic:
+
+    # imitate best strategy among neighbors
+    def replicator(scores, strategies, pool, valid, rng, pool_scores=None):
+        pool_scores = scores[pool] if pool_scores is None else pool_scores
+        if valid is not None:
+            pool_scores = np.where(valid, pool_scores, -np.inf)
+        rows = np.arange(len(pool))
+        columns = pool_scores.argmax(axis=1)
+        best = pool[rows, columns]
+        return np.where(pool_scores[rows, columns] > scores, strategies[best], strategies)
+
+    # adopt better strategies probabilistically
+    def fermi(scores, strategies, pool, valid, rng, beta=0.1, pool_scores=None):
+        rows = np.arange(len(pool))
+        columns = pick_columns(pool, valid, rng)
+        other = pool[rows, columns]
+        other_scores = scores[other] if pool_scores is None else pool_scores[rows, columns]
+        delta = other_scores - scores
+        adopt = (delta > 0) | (rng.random(len(scores)) < np.exp(beta * np.minimum(delta, 0)))
+        return np.where((columns >= 0) & adopt, strategies[other], strategies)
+
+    # probability of choosing strategy proportional to fitness
+    def moran(scores, strategies, pool, valid, rng, pool_scores=None):
+        n = len(scores)
+        candidates = np.column_stack([np.arange(n), pool])
+        pool_scores = scores[pool] if pool_scores is None else pool_scores
+        weights = np.maximum(np.column_stack([scores, pool_scores]), 0)
+        members = np.ones(candidates.shape, dtype=bool)
+        if valid is not None:
+            members[:, 1:] = valid
+            weights[~members] = 0
+        # without any positive payoff every member of the pool is equally likely
+        weights = np.where((weights.sum(axis=1) <= 0)[:, None], members, weights)
+        cumulative = np.cumsum(weights, axis=1)
+        draw = rng.random(n) * cumulative[:, -1]
+        columns = (cumulative > draw[:, None]).argmax(axis=1)
+        return strategies[candidates[np.arange(n), columns]]
+
+    # random
+    def random_copy(scores, strategies, pool, valid, rng, pool_scores=None):
+        other = pick_neighbors(pool, valid, rng)
+        return np.where(other >= 0, strategies[other], strategies)
+
+    # threshold driven random strategy adoption
+    def aspiration(scores, strategies, pool, valid, rng, pool_scores=None):
+        pool_scores = scores[pool] if pool_scores is None else pool_scores
+        if valid is None:
+            avg_payoff = pool_scores.mean(axis=1)
+        else:
+            counts = valid.sum(axis=1)
+            avg_payoff = np.where(valid, pool_scores, 0).sum(axis=1) / np.maximum(counts, 1)
+        other = pick_neighbors(pool, valid, rng)
+        adopt = (other >= 0) & (scores < avg_payoff)
+        return np.where(adopt, strategies[other], strategies)
+
+# rejection rounds of WindowedLearningDynamic.moran before the remaining cells are drawn exactly
+_MORAN_ROUNDS = 32
+
+# the windowed rules take the scores and strategy ids of the whole population, a Window over the
+# grid and a NumPy Generator. they return the new strategy ids. a cell learns from the neighbors
+# of its own type
+class WindowedLearningDynamic:
+
+    # imitate best strategy among neighbors. a tie between neighbors with different strategies
+    # goes to the strategy listed first
+    def replicator(scores, strategies, window, rng):
+        n_strategies = int(strategies.max()) + 1
+        best_scores = np.stack([window.same_type_max(np.where(strategies == s, scores, -np.inf))
+                                for s in range(n_strategies)])
+        best = best_scores.argmax(axis=0)
+        return np.where(best_scores.max(axis=0) > scores, best, strategies).astype(strategies.dtype)
+
+    # adopt better strategies probabilistically
+    def fermi(scores, strategies, window, rng, beta=0.1):
+        other = window.pick(rng, same_type=True)
+        delta = scores[other] - scores
+        adopt = (delta > 0) | (rng.random(len(scores)) < np.exp(beta * np.minimum(delta, 0)))
+        return np.where((other >= 0) & adopt, strategies[other], strategies)
+
+    # probability of choosing strategy proportional to fitness. a uniformly drawn member of the
+    # pool (the agent or one of its slots) is accepted with probability weight / largest weight
+    def moran(scores, strategies, window, rng):
+        n = len(scores)
+        weights = np.maximum(scores, 0)
+        largest = window.same_type_max(weights)
+        k = len(window.offsets)
+        chosen = np.arange(n)
+        pending = np.arange(n)
+        # without any positive payoff every member of the pool is equally likely
+        uniform = largest <= 0
+        for _ in range(_MORAN_ROUNDS):
+            if len(pending) == 0:
+                break
+            slots = rng.integers(k + 1, size=len(pending))
+            target, valid = window.targets(pending, np.minimum(slots, k - 1), same_type=True)
+            own = slots == k
+            target = np.where(own, pending, target)
+            valid |= own
+            accept = valid & (uniform[pending] | (rng.random(len(pending)) * largest[pending] < weights[target]))
+            chosen[pending[accept]] = target[accept]
+            pending = pending[~accept]
+        if len(pending):
+            # the few cells left are drawn from their whole pool
+            targets, valid = window.table(pending, same_type=True)
+            candidates = np.column_stack([pending, targets])
+            members = np.column_stack([np.ones(len(pending), dtype=bool), valid])
+            pool_weights = np.where(members, weights[candidates], 0)
+            pool_weights = np.where((pool_weights.sum(axis=1) <= 0)[:, None], members, pool_weights)
+            cumulative = np.cumsum(pool_weights, axis=1)
+            draw = rng.random(len(pending)) * cumulative[:, -1]
+            columns = (cumulative > draw[:, None]).argmax(axis=1)
+            chosen[pending] = candidates[np.arange(len(pending)), columns]
+        return strategies[chosen]
+
+    # random
+    def random_copy(scores, strategies, window, rng):
+        other = window.pick(rng, same_type=True)
+        return np.where(other >= 0, strategies[other], strategies)
+
+    # threshold driven random strategy adoption
+    def aspiration(scores, strategies, window, rng):
+        avg_payoff = window.same_type_sum(scores) / np.maximum(window.learn_counts, 1)
+        other = window.pick(rng, same_type=True)
+        adopt = (other >= 0) & (scores < avg_payoff)
+        return np.where(adopt, strategies[other], strategies)
+
+# batched version of a LearningDynamic rule, None if there is none
+def batched(dynamic):
+    return getattr(BatchedLearningDynamic, dynamic.__name__, None)
+
+# windowed version of a LearningDynamic rule, None if there is none
+def windowed(dynamic):
+    return getattr(WindowedLearningDynamic, dynamic.__name__, None)
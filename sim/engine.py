@@ -0,0 +1,578 @@
+"""
+engine.py contains an array-backed engine for the simulation. Instead of a grid of Agent
+objects the population is stored as integer strategy and type arrays, and partner selection,
+payoffs and the strategy update are done for the whole grid at once with NumPy.
+
+The engine runs the model of the object path (Simulation.run_iteration) with whole-population
+array operations. An iteration is a sweep over the agents in scan order: every agent plays one
+event against a random partner, then updates its strategy. A history only covers the current
+sweep, so an agent acts again in every event, from the events it played earlier in the sweep.
+The slots of the events (one for the player, one for the partner) are resolved in waves, each
+slot as soon as the slots its strategy reads are. An agent's update reads the strategies from
+before the sweep and the scores its neighbors had at its turn, and the score it carries on is
+its own at that turn; payoffs it receives later in the sweep are dropped. The draws differ from
+the object path's, the statistics do not (see tests/test_engines.py). The state itself lives in a Population (see population.py).
+
+With active_set=True only the frontier is re-evaluated in the strategy update: the cells with
+at least one neighbor they could learn from that plays a different strategy. Every built-in
+dynamic only copies the strategy of the agent or of one of those neighbors, so a cell inside a
+uniform region keeps its strategy whatever the scores and random draws are. The frontier is
+updated around the cells that changed, which makes the update of a settled grid cost work in
+proportion to the length of its boundaries. The interaction still covers every cell, since
+scores accumulate everywhere. Other dynamics and the well-mixed case update every cell.
+
+With config.payoff_mode 'total' or 'expected' every agent plays its whole neighborhood instead
+of one random neighbor: its payoff is the sum (or mean) of the payoffs against all neighbors it
+can play with. The neighbors playing each action are counted with box sums over one plane per
+(type, action), and the strategy update reads the neighborhood through the same Window, so
+neither needs a neighbor table and the cost of an iteration hardly depends on the radius. An
+agent's history records its game against one random neighbor.
+
+schedule='random_sequential' or 'event' replaces the strategy update of the sweep with one agent
+at a time after it, from the scores of the whole sweep, see schedule.py.
+
+With replicas=R the engine runs R independent copies of the grid at once, for an ensemble (see
+ensemble.py). The grids are stored one after the other in the same flat arrays and the neighbor
+table is offset per grid, so no cell has a neighbor in another replica and one step advances
+them all with the same NumPy calls as a single grid. Every replica draws from its own generator,
+seeded from a child of SeedSequence(seed), so replica r runs exactly like a single engine seeded
+with seeds[r].
+"""
+
+import functools
+import itertools
+import numpy as np
+from sim.game import ResponseTable, MixedStrategy
+from sim.population import Population
+from sim.neighborhood import WellMixed, neighbor_table, pick_neighbors
+from sim.dynamics import batched, windowed
+from sim.window import Window
+from sim.cycles import IMITATION_DYNAMICS
+from sim.schedule import make_schedule
+
+# largest number of history states a strategy is tabulated over
+_MAX_STATES = 4096
+
+class VectorizedEngine:
+    def __init__(self, game_config, config, dynamic, agent_types=None, seed=None, active_set=False,
+                 schedule='synchronous', replicas=1):
+        self.game_config = game_config
+        self.config = config
+        self.dynamic = dynamic
+        self.agent_types = list(agent_types) if agent_types and len(agent_types) > 1 else []
+        self.size = config.size
+        self.replicas = replicas
+        self.n = replicas * self.size ** 2
+        # an independent random stream per replica, see _ReplicaRandom
+        self.seeds = replica_seeds(seed, replicas)
+        self.generators = [np.random.default_rng(replica_seed) for replica_seed in self.seeds]
+        self.rng = self.generators[0] if replicas == 1 else _ReplicaRandom(self.generators)
+
+        self._build_actions()
+        self._compile_strategies()
+        self._build_payoffs()
+
+        self.population = Population(self.size, self._init_strategies(), self._init_types(),
+                                     game_config.strategies, self.agent_types, self.actions,
+                                     game_config.history_depth(), replicas)
+        types = self.population.types
+
+        self.well_mixed = config.radius < 1
+        # a perfect matching pairs the whole population up, so every pair plays once per iteration
+        self.paired = self.well_mixed and config.matching == 'perfect'
+        # every neighbor is played at once, see the module docstring
+        self.neighborhood = not self.well_mixed and config.payoff_mode != 'pairwise'
+        if replicas > 1 and (self.well_mixed or self.neighborhood or schedule != 'synchronous'):
+            raise ValueError("Replicas need radius >= 1, payoff_mode='pairwise' and the synchronous schedule")
+        if self.well_mixed:
+            self.mixing = WellMixed(types)
+        elif self.neighborhood:
+            self.window = Window(self.size, config.radius, config.topology, types)
+        else:
+            table = neighbor_table(self.size, config.radius, config.topology)
+            if replicas > 1:
+                table = _Replicated(table, replicas)
+            self.neighbors = table.indices
+            self.neighbor_valid = table.valid
+            if self.agent_types:
+                same_type = types[self.neighbors] == types[:, None]
+                self.partner_valid = table.mask(~same_type)
+                self.learn_valid = table.mask(same_type)
+            else:
+                self.partner_valid = table.mask()
+                self.learn_valid = table.mask()
+
+        self.update_rule = windowed(dynamic) if self.neighborhood else batched(dynamic)
+        if self.update_rule is None:
+            raise ValueError(f"No batched version of learning dynamic '{dynamic.__name__}'")
+
+        # cells that can change strategy in the next update, see the module docstring
+        self.active_set = (active_set and not self.well_mixed and not self.neighborhood
+                           and dynamic.__name__ in IMITATION_DYNAMICS)
+        if self.active_set:
+            self.frontier = np.zeros(self.n, dtype=bool)
+            self._local_index = np.zeros(self.n, dtype=np.intp)
+        self.schedule = schedule
+        self.scheduler = make_schedule(schedule, self)
+        # times the phases of step when set, see profiling.py
+        self.profiler = None
+
+    # index every action used by the game, valid actions first
+    def _build_actions(self):
+        self.actions = self.game_config.action_list()
+        self.action_ids = {action: i for i, action in enumerate(self.actions)}
+
+    def _action_id(self, action):
+        if action not in self.action_ids:
+            raise ValueError(f"Strategy returned unknown action {action!r}")
+        return self.action_ids[action]
+
+    # dense payoff matrix indexed by [row action, column action, player]
+    def _build_payoffs(self):
+        n_actions = len(self.actions)
+        self.payoff_matrix = np.zeros((n_actions, n_actions, 2))
+        for (a1, a2), payoff in self.game_config.payoff_matrix.items():
+            self.payoff_matrix[self.action_ids[a1], self.action_ids[a2]] = payoff
+
+    # turn the strategies into arrays so that acting is a lookup for the whole population. a
+    # ResponseTable gets its action for every history state (see HistoryArray.state) of the last
+    # `table_memory` interactions, a MixedStrategy its cumulative probabilities. a plain Strategy
+    # may depend on anything, so it is always called once per agent, as is a ResponseTable that
+    # reads too long a history to tabulate
+    def _compile_strategies(self):
+        strategies = self.game_config.strategies
+        type_names = self.agent_types or [None]
+        n_actions = len(self.actions)
+        base = n_actions ** 2 + 1
+        self.mixed = np.array([isinstance(strategy, MixedStrategy) for strategy in strategies])
+        self.per_agent = np.array([not mixed and (not isinstance(strategy, ResponseTable)
+                                                  or base ** strategy.memory > _MAX_STATES)
+                                   for strategy, mixed in zip(strategies, self.mixed)])
+        # interactions every strategy reads
+        self.memory = np.array([0 if mixed else strategy.memory for strategy, mixed in zip(strategies, self.mixed)])
+        self.table_memory = max((strategy.memory for s, strategy in enumerate(strategies)
+                                 if not self.mixed[s] and not self.per_agent[s]), default=0)
+        histories = self._state_histories(self.table_memory)
+
+        self.action_table = np.zeros((len(strategies), len(type_names), base ** self.table_memory), dtype=np.int8)
+        self.mix_cumulative = np.zeros((len(strategies), len(type_names), n_actions))
+        for s, strategy in enumerate(strategies):
+            for t, type_name in enumerate(type_names):
+                if self.mixed[s]:
+                    self.mix_cumulative[s, t] = self._cumulative(strategy.probabilities_for(type_name))
+                elif not self.per_agent[s]:
+                    self._tabulate(s, t, strategy, type_name, histories)
+
+    def _tabulate(self, s, t, strategy, type_name, histories):
+        answers = {}
+        for state, recent in histories:
+            seen = tuple(recent[-strategy.memory:]) if strategy.memory else ()
+            if seen not in answers:
+                answers[seen] = self._action_id(strategy.act(list(seen), type_name))
+            self.action_table[s, t, state] = answers[seen]
+
+    # every history of up to `memory` interactions as (state, [(own, opp), ...] oldest first)
+    def _state_histories(self, memory):
+        pairs = [(own, opp) for own in self.actions for opp in self.actions]
+        base = len(pairs) + 1
+        histories = []
+        for length in range(memory + 1):
+            for recent in itertools.product(pairs, repeat=length):
+                state = sum((1 + pairs.index(pair)) * base ** j for j, pair in enumerate(reversed(recent)))
+                histories.append((state, list(recent)))
+        return histories
+
+    # cumulative probabilities over the action ids, ending at exactly 1 at the last possible action
+    def _cumulative(self, probabilities):
+        weights = np.zeros(len(self.actions))
+        for action, probability in probabilities.items():
+            weights[self._action_id(action)] += probability
+        cumulative = np.cumsum(weights)
+        if cumulative[-1] <= 0:
+            raise ValueError("A mixed strategy needs a positive probability")
+        return np.where(cumulative >= cumulative[-1], 1.0, cumulative / cumulative[-1])
+
+    # same rules as Simulation._init_grid: exact counts from the distribution, rounding error
+    # filled with random strategies, then shuffled. every replica gets its own grid, drawn from
+    # its own generator
+    def _init_strategies(self):
+        n_strategies = len(self.game_config.strategies)
+        distribution = self.config.strategy_distribution
+        cells = self.size ** 2
+        grids = []
+        for generator in self.generators:
+            if not distribution:
+                grids.append(generator.integers(n_strategies, size=cells))
+                continue
+            counts = [int(distribution.get(strategy.name, 0) * cells) for strategy in self.game_config.strategies]
+            strategy_list = np.repeat(np.arange(n_strategies), counts)
+            filler = generator.integers(n_strategies, size=cells - len(strategy_list))
+            strategy_list = np.concatenate([strategy_list, filler])
+            generator.shuffle(strategy_list)
+            grids.append(strategy_list)
+        return np.concatenate(grids).astype(np.int8)
+
+    # the generator for a draw of one value per row, where row i belongs to cell cells[i]
+    def _rng_for(self, cells):
+        if self.replicas == 1:
+            return self.rng
+        return self.rng.rows(cells // self.size ** 2)
+
+    # types alternate along rows and columns, like a checkerboard, the same in every replica
+    def _init_types(self):
+        if not self.agent_types:
+            return np.zeros(self.n, dtype=np.int8)
+        x, y = np.divmod(np.arange(self.size ** 2), self.size)
+        return np.tile((x + y) % len(self.agent_types), self.replicas).astype(np.int8)
+
+    # action of every agent, or of `cells`, for this iteration
+    def _actions(self, cells=None, strategies=None, rng=None):
+        pop = self.population
+        cells = slice(None) if cells is None else cells
+        strategies = (pop.strategies if strategies is None else strategies)[cells]
+        types = pop.types[cells]
+        rng = self.rng if rng is None else rng
+        state = pop.histories.state(self.table_memory, len(self.actions), cells)
+        actions = self.action_table[strategies, types, state]
+        mixed = np.flatnonzero(self.mixed[strategies])
+        if len(mixed):
+            cumulative = self.mix_cumulative[strategies[mixed], types[mixed]]
+            actions[mixed] = (cumulative <= rng.random(len(mixed))[:, None]).sum(axis=1)
+        if self.per_agent.any():
+            index = np.arange(self.n)[cells]
+            for s in np.flatnonzero(self.per_agent):
+                strategy = self.game_config.strategies[s]
+                for i in np.flatnonzero(strategies == s):
+                    history = pop.history(index[i], strategy.memory)
+                    actions[i] = self._action_id(strategy.act(history, pop.type_name(index[i])))
+        return actions
+
+    def step(self):
+        pop = self.population
+        profiler = self.profiler
+        if self.neighborhood:
+            self._step_neighborhood()
+            return
+        if self.well_mixed:
+            if self.paired:
+                partners = self.mixing.matching(self.rng)
+            else:
+                partners = self.mixing.partners(self.rng)
+            # typed games learn from another random agent of the same type, untyped from the partner
+            pool = self.mixing.partners(self.rng, same_type=True) if self.agent_types else partners
+            pool = pool[:, None]
+            valid = pool >= 0 if (pool < 0).any() else None
+        else:
+            partners = pick_neighbors(self.neighbors, self.partner_valid, self.rng)
+            pool, valid = self.neighbors, self.learn_valid
+        if profiler is not None:
+            profiler.lap('partners')
+
+        # interaction, one event per player in scan order
+        if self.paired:
+            players = np.flatnonzero(partners > np.arange(self.n))
+        else:
+            players = np.flatnonzero(partners >= 0)
+        partners = partners[players]
+        actions = self._sweep_actions(players, partners)
+        payoffs = self.payoff_matrix[actions[0::2], actions[1::2]]
+        scores = (pop.scores + np.bincount(players, weights=payoffs[:, 0], minlength=self.n)
+                  + np.bincount(partners, weights=payoffs[:, 1], minlength=self.n))
+        # the histories only last for one sweep
+        pop.histories.clear(slice(None))
+        if profiler is not None:
+            profiler.lap('interact')
+
+        # strategy update
+        if self.scheduler is not None:
+            self._set_scores(scores)
+            self.scheduler.learn()
+            if profiler is not None:
+                profiler.lap('learn')
+            return
+        # an agent keeps the score it had at its own turn
+        later = players > partners
+        turn_scores = scores - np.bincount(partners[later], weights=payoffs[later, 1], minlength=self.n)
+        seen = functools.partial(self._seen_scores, scores, players, partners, payoffs, pool)
+        if self.active_set:
+            self._update_frontier(turn_scores, seen)
+            self._set_scores(turn_scores)
+            if profiler is not None:
+                profiler.lap('learn')
+            return
+        new_strategies = self.update_rule(turn_scores, pop.strategies, pool, valid, self.rng,
+                                          pool_scores=seen())
+        self._set_scores(turn_scores)
+        if profiler is not None:
+            profiler.lap('learn')
+        pop.swap(new_strategies)
+        if profiler is not None:
+            profiler.lap('count')
+
+    def _set_scores(self, scores):
+        pop = self.population
+        np.copyto(pop.scores, scores)
+        pop.total_score = scores.sum()
+
+    # actions of both sides of every event. slot 2e is the player of event e and slot 2e + 1 its
+    # partner, so the slots are in the order the sweep plays them. an agent acts from its earlier
+    # slots of the sweep, so a slot is resolved in the first round in which the slots its strategy
+    # reads are
+    def _sweep_actions(self, players, partners):
+        pop = self.population
+        cells = np.column_stack([players, partners]).ravel()
+        strategies = pop.strategies[cells]
+        types = pop.types[cells]
+        n_actions = len(self.actions)
+        base = n_actions ** 2 + 1
+        actions = np.full(len(cells), -1, dtype=np.intp)
+        mixed = self.mixed[strategies]
+        if mixed.any():
+            slots = np.flatnonzero(mixed)
+            cumulative = self.mix_cumulative[strategies[slots], types[slots]]
+            draw = self._rng_for(cells[slots]).random(len(slots))
+            actions[slots] = (cumulative <= draw[:, None]).sum(axis=1)
+        # previous slot of the same cell, -1 for its first
+        reads = self.memory[strategies]
+        previous = np.full(len(cells), -1, dtype=np.intp)
+        if reads.any():
+            order = np.argsort(cells, kind='stable')
+            repeat = np.flatnonzero(cells[order][1:] == cells[order][:-1]) + 1
+            previous[order[repeat]] = order[repeat - 1]
+
+        # slots that read nothing are resolved at once, the others in waves as their history is
+        waiting = ~mixed & (reads > 0) & (previous >= 0)
+        done = np.flatnonzero(~mixed & ~waiting)
+        state = np.zeros(len(done), dtype=np.intp)
+        pending = np.flatnonzero(waiting)
+        while len(done):
+            called = self.per_agent[strategies[done]]
+            tabled = done[~called]
+            actions[tabled] = self.action_table[strategies[tabled], types[tabled], state[~called]]
+            for slot in done[called]:
+                strategy = self.game_config.strategies[strategies[slot]]
+                actions[slot] = self._action_id(strategy.act(self._sweep_history(slot, previous, actions, strategy.memory),
+                                                             pop.type_name(cells[slot])))
+            if len(pending) == 0:
+                break
+            memory = reads[pending]
+            ready = np.ones(len(pending), dtype=bool)
+            state = np.zeros(len(pending), dtype=np.intp)
+            back = pending
+            for j in range(int(memory.max())):
+                back = np.where(back >= 0, previous[back], -1)
+                read = (back >= 0) & (memory > j)
+                own, opp = actions[back], actions[back ^ 1]
+                ready &= ~read | ((own >= 0) & (opp >= 0))
+                if j < self.table_memory:
+                    state += np.where(read, 1 + own * n_actions + opp, 0) * base ** j
+            done, state = pending[ready], state[ready]
+            pending = pending[~ready]
+        return actions
+
+    # the last `memory` interactions before a slot as (my_action, their_action), oldest first
+    def _sweep_history(self, slot, previous, actions, memory):
+        history = []
+        slot = previous[slot]
+        while slot >= 0 and len(history) < memory:
+            history.append((self.actions[actions[slot]], self.actions[actions[slot ^ 1]]))
+            slot = previous[slot]
+        return history[::-1]
+
+    # scores of the learning pools of `cells` as each of them saw them at its own turn: the
+    # scores after the sweep less the payoffs of the events played after that turn
+    def _seen_scores(self, scores, players, partners, payoffs, pool, cells=None):
+        rows = np.arange(self.n) if cells is None else cells
+        others = pool if cells is None else pool[cells]
+        # an agent plays its own event at its turn, so the cells after it are seen without it
+        own = np.zeros(self.n)
+        own[players] = payoffs[:, 0]
+        before_turn = np.column_stack([scores, scores - own]).ravel()
+        seen = before_turn[2 * others + (others > rows[:, None])]
+        if self.well_mixed:
+            # payoffs received as partner, summed per partner in the order of the players
+            order = np.lexsort((players, partners))
+            keys = partners[order] * self.n + players[order]
+            received = np.concatenate([[0], np.cumsum(payoffs[order, 1])])
+            other = np.maximum(others[:, 0], 0)
+            after = np.searchsorted(keys, other * self.n + rows, side='right')
+            end = np.searchsorted(keys, (other + 1) * self.n)
+            seen[:, 0] -= received[end] - received[after]
+            return seen
+        # the event of player p with partner x is paid after the turn of the cells before p that
+        # learn from x. x is in slot m of their pool where they are in slot k - 1 - m of x's, as
+        # the neighbor offsets are symmetric
+        k = pool.shape[1]
+        slots = pool[partners]
+        later = slots < players[:, None]
+        if self.neighbor_valid is not None:
+            later &= self.neighbor_valid[partners]
+        slots *= k
+        slots += np.arange(k - 1, -1, -1)
+        late = np.bincount(slots.ravel(), weights=(later * payoffs[:, 1:]).ravel(),
+                           minlength=self.n * k).reshape(self.n, k)
+        seen -= late if cells is None else late[cells]
+        return seen
+
+    # one iteration with payoffs against the whole neighborhood
+    def _step_neighborhood(self):
+        pop = self.population
+        profiler = self.profiler
+        actions = self._actions()
+        payoffs = self._neighborhood_payoffs(actions)
+        pop.scores += payoffs
+        pop.total_score += payoffs.sum()
+        if pop.histories.depth:
+            if profiler is not None:
+                profiler.lap('interact')
+            partners = self.window.pick(self.rng, same_type=False)
+            if profiler is not None:
+                profiler.lap('partners')
+            players = np.flatnonzero(partners >= 0)
+            self._push_both(players, partners[players], actions)
+        if profiler is not None:
+            profiler.lap('interact')
+
+        new_strategies = self.update_rule(pop.scores, pop.strategies, self.window, self.rng)
+        if profiler is not None:
+            profiler.lap('learn')
+        changed = pop.swap(new_strategies)
+        pop.histories.clear(changed)
+        if profiler is not None:
+            profiler.lap('count')
+
+    # record every interaction in the histories of both agents, like Simulation._interact. the
+    # players are in scan order, so every cell gets its interactions in the order the object
+    # path plays them
+    def _push_both(self, players, partners, actions):
+        histories = self.population.histories
+        if histories.depth == 0:
+            return
+        cells = np.column_stack([players, partners]).ravel()
+        own = actions[cells]
+        opp = actions[np.column_stack([partners, players]).ravel()]
+        histories.push_all(cells, own, opp)
+
+    # payoff of every agent against all the neighbors it can play with
+    def _neighborhood_payoffs(self, actions):
+        pop = self.population
+        cells = np.arange(self.n)
+        n_types, n_actions = pop.n_types, len(self.actions)
+        # agents per (type, action) in the neighborhood of every cell
+        planes = np.zeros((n_types * n_actions, self.n))
+        planes[pop.types.astype(np.intp) * n_actions + actions, cells] = 1
+        counts = self.window.box_sum(planes.reshape(-1, self.size, self.size)).reshape(n_types, n_actions, self.n)
+        # the center of the window is the agent itself
+        counts[pop.types, actions, cells] -= 1
+        if self.agent_types:
+            # typed games play the agents of the other types
+            opponents = counts.sum(axis=0) - counts[pop.types, :, cells].T
+        else:
+            opponents = counts[0]
+        payoffs = (self.payoff_matrix[actions, :, 0] * opponents.T).sum(axis=1)
+        if self.config.payoff_mode == 'expected':
+            payoffs /= np.maximum(opponents.sum(axis=0), 1)
+        return payoffs
+
+    # strategy update of the frontier cells only
+    def _update_frontier(self, scores, seen):
+        pop = self.population
+        touched = pop.touched
+        if touched is None:
+            self.frontier[:] = self._mixed(np.arange(self.n))
+        elif len(touched):
+            self._refresh(np.asarray(touched, dtype=np.intp))
+        active = np.flatnonzero(self.frontier)
+        changed = active[:0]
+        if len(active):
+            local, pool, valid = self._local_pool(active)
+            # the neighbors' rows are never read
+            pool_scores = np.zeros(pool.shape)
+            pool_scores[:len(active)] = seen(active)
+            new = self.update_rule(scores[local], pop.strategies[local], pool, valid, self._rng_for(local),
+                                   pool_scores=pool_scores)
+            changed = pop.assign(active, new[:len(active)])
+            self._refresh(changed)
+        pop.touched = []
+
+    # true for the cells that have a neighbor to learn from with a different strategy
+    def _mixed(self, cells):
+        strategies = self.population.strategies
+        differs = strategies[self.neighbors[cells]] != strategies[cells, None]
+        if self.learn_valid is not None:
+            differs &= self.learn_valid[cells]
+        return differs.any(axis=1)
+
+    # a change of strategy can only move the frontier at the cell and its neighbors
+    def _refresh(self, cells):
+        if len(cells) == 0:
+            return
+        around = np.unique(np.concatenate([cells, self.neighbors[cells].ravel()]))
+        self.frontier[around] = self._mixed(around)
+
+    # the learning pools of `cells` in a small local index space: the cells themselves followed by
+    # the neighbors they read. the neighbors get a pool of only themselves, none of it valid, so
+    # the batched rules leave them unchanged
+    def _local_pool(self, cells):
+        pool = self.neighbors[cells]
+        others = np.setdiff1d(pool, cells)
+        local = np.concatenate([cells, others])
+        self._local_index[local] = np.arange(len(local))
+        k = pool.shape[1]
+        pool = np.vstack([self._local_index[pool], np.repeat(np.arange(len(cells), len(local))[:, None], k, axis=1)])
+        valid = np.zeros(pool.shape, dtype=bool)
+        valid[:len(cells)] = True if self.learn_valid is None else self.learn_valid[cells]
+        return local, pool, valid
+
+# one SeedSequence per replica, spawned from `seed`. a SeedSequence given for a single grid is used
+# as it is, so a replica of an ensemble runs on its own from its entry in VectorizedEngine.seeds
+def replica_seeds(seed, replicas):
+    if replicas == 1 and isinstance(seed, np.random.SeedSequence):
+        return [seed]
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(replicas)
+
+# the random draws of an ensemble, with the interface of the Generator methods the engine uses.
+# every replica has its own generator: a draw of one value per row takes the values of a
+# replica's rows from its generator, in row order, so each replica draws what a single grid
+# would. `replica` is the replica of every row, None for the grids one after the other
+class _ReplicaRandom:
+    def __init__(self, generators, replica=None):
+        self.generators = generators
+        self.replica = replica
+
+    # the same generators for a draw over rows of the given replicas
+    def rows(self, replica):
+        return _ReplicaRandom(self.generators, replica)
+
+    def random(self, size):
+        return self._draw(size, lambda generator, count: generator.random(count))
+
+    def integers(self, high, size):
+        return self._draw(size, lambda generator, count: generator.integers(high, size=count))
+
+    def _draw(self, size, draw):
+        if self.replica is None:
+            return np.concatenate([draw(generator, size // len(self.generators)) for generator in self.generators])
+        counts = np.bincount(self.replica, minlength=len(self.generators))
+        values = np.concatenate([draw(generator, count) for generator, count in zip(self.generators, counts)])
+        drawn = np.empty_like(values)
+        drawn[np.argsort(self.replica, kind='stable')] = values
+        return drawn
+
+# a neighbor table repeated for `replicas` grids stored one after the other, with the same
+# interface as the NeighborTable it wraps
+class _Replicated:
+    def __init__(self, table, replicas):
+        cells = table.size ** 2
+        offsets = np.arange(replicas)[:, None, None] * cells
+        self.indices = (table.indices + offsets).reshape(replicas * cells, -1)
+        self.valid = None if table.valid is None else np.tile(table.valid, (replicas, 1))
+
+    def mask(self, condition=None):
+        if condition is None:
+            return self.valid
+        if self.valid is None:
+            return condition
+        return self.valid & condition
@@ -1,6 +1,11 @@
 """
 Game.py contains the definitions for the games and the strategies used in the simulation.
 All relevant game types are defined here, along with strategies and associated metadata.
+
+A Strategy wraps any function of (history, type). ResponseTable and MixedStrategy describe a
+strategy as data instead: the action for each recent history, or the probability of each
+action. The vectorized engine turns those into arrays and picks the actions of the whole
+population at once, while a plain Strategy is always called once per agent.
 """
 
 from enum import Enum
@@ -8,14 +13,93 @@ import random
 from dataclasses import dataclass
 from typing import Dict, List, Tuple
 
+# number of past interactions kept for strategies that do not declare how many they read
+DEFAULT_MEMORY = 8
+
 class Strategy:
-    def __init__(self, name, actor):
+    def __init__(self, name, actor, memory=DEFAULT_MEMORY):
         self.name = name
         self.actor = actor
-        
+        # how many past interactions the actor reads. agents keep the largest memory among
+        # the game's strategies, older interactions are dropped
+        self.memory = memory
+
     def act(self, history, type):
         return self.actor(history, type)
 
+# a per-type spec ({type name: spec}, None standing for every other type) or one spec for all
+def _by_type(spec, is_spec):
+    if is_spec(spec):
+        return {None: spec}
+    return dict(spec)
+
+def _for_type(by_type, type, name):
+    if type in by_type:
+        return by_type[type]
+    if None in by_type:
+        return by_type[None]
+    raise ValueError(f"Strategy '{name}' has no entry for agent type {type!r}")
+
+# deterministic strategy given as the action to play after the last `memory` interactions.
+# responses maps a tuple of (own, opponent) action pairs, oldest first, to an action. None in
+# a pair matches any action, and the keys shorter than `memory` cover the first iterations.
+# responses can also be a dict of such tables per agent type
+class ResponseTable(Strategy):
+    def __init__(self, name, responses, memory=0, default=None):
+        self.responses = _by_type(responses, lambda spec: all(isinstance(key, tuple) for key in spec))
+        self.default = default
+        self._cache = {}
+        super().__init__(name, self._respond, memory)
+
+    def _respond(self, history, type):
+        if self.memory == 0 or not history:
+            recent = ()
+        elif self.memory == 1:
+            recent = (history[-1],)
+        else:
+            recent = tuple(history[-self.memory:])
+        key = (type, recent)
+        action = self._cache.get(key)
+        if action is None:
+            action = self._cache[key] = self._lookup(recent, type)
+        return action
+
+    def _lookup(self, recent, type):
+        for pattern, action in _for_type(self.responses, type, self.name).items():
+            if len(pattern) == len(recent) and all(
+                    (own is None or own == played[0]) and (opp is None or opp == played[1])
+                    for (own, opp), played in zip(pattern, recent)):
+                return action
+        if self.default is None:
+            raise ValueError(f"Strategy '{self.name}' has no response to {list(recent)}")
+        return self.default
+
+# strategy that ignores the history and draws its action with fixed probabilities, given as
+# {action: probability} (drawn in that order) or a dict of those per agent type
+class MixedStrategy(Strategy):
+    def __init__(self, name, probabilities):
+        self.probabilities = _by_type(probabilities, lambda spec: all(not isinstance(p, dict) for p in spec.values()))
+        # (running total, action) per type, compared against one uniform draw
+        self._thresholds = {}
+        for type, spec in self.probabilities.items():
+            cumulative = 0
+            self._thresholds[type] = thresholds = []
+            for action, probability in spec.items():
+                cumulative += probability
+                thresholds.append((cumulative, action))
+        super().__init__(name, self._draw, memory=0)
+
+    def probabilities_for(self, type):
+        return _for_type(self.probabilities, type, self.name)
+
+    def _draw(self, history, type):
+        r = random.random()
+        for cumulative, action in _for_type(self._thresholds, type, self.name):
+            if r < cumulative:
+                return action
+        # rounding left r above the last sum
+        return action
+
 @dataclass
 class GameConfig:
     name: str
@@ -26,6 +110,19 @@ class GameConfig:
     valid_actions: List[str]
     agent_types: List[str]
 
+    # every action of the game, valid actions first, then any other action used in the payoffs
+    def action_list(self):
+        actions = list(self.valid_actions)
+        for key in self.payoff_matrix:
+            for action in key:
+                if action not in actions:
+                    actions.append(action)
+        return actions
+
+    # number of past interactions an agent has to keep for this game's strategies
+    def history_depth(self):
+        return max(strategy.memory for strategy in self.strategies)
+
 class GameType(Enum):
     # prisoners dilema 
     PD = GameConfig(
@@ -37,9 +134,9 @@ class GameType(Enum):
             ('D', 'D'): (1, 1)
         },
         strategies=[
-            Strategy("Cooperate", lambda h, t: 'C'),
-            Strategy("Defect", lambda h, t: 'D'),
-            Strategy("TitForTat", lambda h, t: h[-1][1] if h else 'C')
+            ResponseTable("Cooperate", {(): 'C'}),
+            ResponseTable("Defect", {(): 'D'}),
+            ResponseTable("TitForTat", {(): 'C', ((None, 'C'),): 'C', ((None, 'D'),): 'D'}, memory=1)
         ],
         strategy_colors={
             'Cooperate': '#2ecc71',
@@ -60,9 +157,11 @@ class GameType(Enum):
             ('H', 'H'): (3, 3)
         },
         strategies=[
-            Strategy("Always Stag", lambda h, t: 'S'),
-            Strategy("Always Hare", lambda h, t: 'H'),
-            Strategy("Cautious", lambda h, t: 'S' if h.count('S') > h.count('H') else 'H')
+            ResponseTable("Always Stag", {(): 'S'}),
+            ResponseTable("Always Hare", {(): 'H'}),
+            # written as 'S' if h.count('S') > h.count('H') else 'H' before, but those counts compare
+            # whole (own, opp) entries with a single action and are always 0, so it hunts hare
+            ResponseTable("Cautious", {(): 'H'})
         ],
         strategy_colors={
             'Always Stag': '#1abc9c',
@@ -83,9 +182,9 @@ class GameType(Enum):
             ('D', 'D'): (2, 2)
         },
         strategies=[
-            Strategy("Always Hawk", lambda h, t: 'H'),
-            Strategy("Always Dove", lambda h, t: 'D'),
-            Strategy("Random", lambda h, t: 'H' if random.random() < 0.5 else 'D')
+            ResponseTable("Always Hawk", {(): 'H'}),
+            ResponseTable("Always Dove", {(): 'D'}),
+            MixedStrategy("Random", {'H': 0.5, 'D': 0.5})
         ],
         strategy_colors={
             'Always Hawk': '#f1c40f',
@@ -110,8 +209,8 @@ class GameType(Enum):
             ('U', 'F'): (15, -5)
         },
         strategies=[
-            Strategy("Always Cooperative", lambda h, t: 'F' if t == "Female" else 'H'),
-            Strategy("Always Uncooperative", lambda h, t: 'C' if t == "Female" else 'U')
+            ResponseTable("Always Cooperative", {"Female": {(): 'F'}, None: {(): 'H'}}),
+            ResponseTable("Always Uncooperative", {"Female": {(): 'C'}, None: {(): 'U'}})
         ],
         strategy_colors={
             "Always Cooperative": '#f1c40f',
@@ -136,10 +235,10 @@ class GameType(Enum):
             ('R', 'P'): (1, -1),
         },
         strategies=[
-            Strategy("Always Rock", lambda h, t: 'R'),
-            Strategy("Always Paper", lambda h, t: 'P'),
-            Strategy("Always Scissor", lambda h, t: 'S'),
-            Strategy("Always Random",  lambda h, t: 'R' if (r := random.random()) < 1/3 else 'P' if r < 2/3 else 'S')
+            ResponseTable("Always Rock", {(): 'R'}),
+            ResponseTable("Always Paper", {(): 'P'}),
+            ResponseTable("Always Scissor", {(): 'S'}),
+            MixedStrategy("Always Random", {'R': 1/3, 'P': 1/3, 'S': 1/3})
         ],
         strategy_colors={
             "Always Rock": '#f1c40f',
@@ -0,0 +1,126 @@
+"""
+history.py contains the fixed-window interaction histories used by memory-based strategies.
+History is the ring buffer of a single Agent, HistoryArray keeps the histories of a whole
+population in one array for the vectorized engine. Both store actions as small integer ids
+and only keep the most recent interactions.
+"""
+
+from array import array
+import numpy as np
+
+# ring buffer of (my_action, their_action) pairs. it reads like the list it replaces:
+# h[-1], len(h), iteration and h.count work the same, but only `depth` entries are kept
+class History:
+    __slots__ = ('actions', 'ids', 'depth', 'own', 'opp', 'start', 'length')
+
+    def __init__(self, depth, actions, ids):
+        self.actions = actions
+        self.ids = ids
+        self.depth = depth
+        self.own = array('b', bytes(depth))
+        self.opp = array('b', bytes(depth))
+        self.start = 0
+        self.length = 0
+
+    def append(self, entry):
+        if self.depth == 0:
+            return
+        own, opp = entry
+        if self.length < self.depth:
+            slot = (self.start + self.length) % self.depth
+            self.length += 1
+        else:
+            # full: overwrite the oldest entry
+            slot = self.start
+            self.start = (self.start + 1) % self.depth
+        self.own[slot] = self.ids[own]
+        self.opp[slot] = self.ids[opp]
+
+    def clear(self):
+        self.start = 0
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("history index out of range")
+        slot = (self.start + index) % self.depth
+        return (self.actions[self.own[slot]], self.actions[self.opp[slot]])
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield self[i]
+
+    def count(self, value):
+        return sum(1 for entry in self if entry == value)
+
+    def __repr__(self):
+        return repr(list(self))
+
+# the histories of n agents: row i is the ring buffer of cell i, -1 marks an empty slot
+class HistoryArray:
+    def __init__(self, n, depth):
+        self.n = n
+        self.depth = depth
+        width = max(depth, 1)
+        self.own = np.full((n, width), -1, dtype=np.int8)
+        self.opp = np.full((n, width), -1, dtype=np.int8)
+        # slot the next entry is written to and number of entries kept
+        self.head = np.zeros(n, dtype=np.int16)
+        self.length = np.zeros(n, dtype=np.int16)
+
+    # record one interaction for each of the given (distinct) cells
+    def push(self, cells, own, opp):
+        if self.depth == 0:
+            return
+        slots = self.head[cells]
+        self.own[cells, slots] = own
+        self.opp[cells, slots] = opp
+        self.head[cells] = (slots + 1) % self.depth
+        self.length[cells] = np.minimum(self.length[cells] + 1, self.depth)
+
+    # record interactions of cells that may repeat, each cell's in the order they are given
+    def push_all(self, cells, own, opp):
+        if self.depth == 0 or len(cells) == 0:
+            return
+        order = np.argsort(cells, kind='stable')
+        sorted_cells = cells[order]
+        starts = np.flatnonzero(np.concatenate([[True], sorted_cells[1:] != sorted_cells[:-1]]))
+        # position of every entry among the entries of its cell
+        rank = np.arange(len(cells)) - np.repeat(starts, np.diff(np.append(starts, len(cells))))
+        for r in range(int(rank.max()) + 1):
+            entries = order[rank == r]
+            self.push(cells[entries], own[entries], opp[entries])
+
+    def clear(self, cells):
+        self.head[cells] = 0
+        self.length[cells] = 0
+
+    # the last `memory` interactions of every cell (or of `cells`) as one number. digit j, in
+    # base n_actions^2 + 1, is the j-th most recent interaction as 1 + own * n_actions + opp,
+    # or 0 where there is none
+    def state(self, memory, n_actions, cells=None):
+        rows = np.arange(self.n) if cells is None else np.arange(self.n)[cells]
+        head, length = self.head[rows], self.length[rows]
+        state = np.zeros(len(rows), dtype=np.intp)
+        base = n_actions ** 2 + 1
+        for j in range(min(memory, self.depth)):
+            slots = (head - 1 - j) % self.depth
+            code = 1 + self.own[rows, slots].astype(np.intp) * n_actions + self.opp[rows, slots]
+            state += np.where(length > j, code, 0) * base ** j
+        return state
+
+    # the last `depth` entries of one cell as (own, opp) id pairs, oldest first
+    def window(self, cell, depth=None):
+        length = int(self.length[cell])
+        if depth is not None:
+            length = min(length, depth)
+        head = int(self.head[cell])
+        slots = [(head - length + i) % self.depth for i in range(length)]
+        return [(int(self.own[cell, slot]), int(self.opp[cell, slot])) for slot in slots]
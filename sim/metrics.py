@@ -0,0 +1,153 @@
+"""
+metrics.py contains the writer used to record per-iteration metrics. Rows are buffered and
+appended to the output file every flush_every rows, so memory stays flat on long runs and
+everything up to the last flush is on disk if a run is interrupted.
+
+Parquet keeps its footer, without which the file cannot be read, until the file is closed. So
+Parquet metrics are a directory, e.g. metrics.parquet/, with one complete file per flush
+(part-00000.parquet, part-00001.parquet, ...). pyarrow.parquet.read_table and
+pandas.read_parquet read the directory as one table.
+
+A run resumed from a checkpoint passes resume_after, the iteration of the checkpoint. The
+existing metrics are then cut back to the rows up to that iteration and appended to, so the
+rows written before the checkpoint are kept and the ones after it are not repeated.
+"""
+
+import csv
+import glob
+import os
+
+def has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+# 'auto' writes Parquet when pyarrow is installed and CSV otherwise
+def resolve_format(format):
+    if format == 'auto':
+        format = 'parquet' if has_pyarrow() else 'csv'
+    if format not in ('csv', 'parquet'):
+        raise ValueError(f"Unknown metrics format '{format}'")
+    if format == 'parquet' and not has_pyarrow():
+        raise ImportError("Parquet metrics need pyarrow, install it or use the 'csv' format")
+    return format
+
+class MetricsWriter:
+    def __init__(self, path, flush_every=100, format='csv', resume_after=None):
+        self.path = path
+        self.flush_every = flush_every
+        self.format = resolve_format(format)
+        self.fields = None
+        self.rows = []
+        self.rows_written = 0
+        self._file = None
+        # number of the next Parquet part and the schema every part is written with
+        self._part = None
+        self._schema = None
+        if resume_after is not None and os.path.exists(path):
+            if self.format == 'csv':
+                self._resume_csv(resume_after)
+            else:
+                self._resume_parquet(resume_after)
+
+    # cuts the file after the last row up to iteration `after` and opens it to append the rest
+    def _resume_csv(self, after):
+        with open(self.path, 'r+b') as f:
+            header = f.readline()
+            if not header.strip():
+                return
+            self.fields = next(csv.reader([header.decode()]))
+            column = self.fields.index('iteration')
+            end = f.tell()
+            for line in iter(f.readline, b''):
+                values = next(csv.reader([line.decode()]), None)
+                if not values or len(values) != len(self.fields) or int(float(values[column])) > after:
+                    break
+                self.rows_written += 1
+                end = f.tell()
+            f.truncate(end)
+        self._file = open(self.path, 'a', newline='')
+        self._csv = csv.DictWriter(self._file, fieldnames=self.fields, lineterminator='\n')
+
+    # drops the parts after iteration `after`, and the rows after it from the part it falls in
+    def _resume_parquet(self, after):
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+        self._part = 0
+        for part in self._parts():
+            table = pq.read_table(part)
+            if self._part > 0 and pc.min(table['iteration']).as_py() > after:
+                os.remove(part)
+                continue
+            if pc.max(table['iteration']).as_py() > after:
+                table = table.filter(pc.less_equal(table['iteration'], after))
+                self._write_part(table, part)
+            self._schema = table.schema
+            self.fields = table.schema.names
+            self.rows_written += table.num_rows
+            self._part += 1
+
+    # the part files of the Parquet directory, in the order they were written
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self.path, 'part-*.parquet')))
+
+    # written under a hidden temporary name first, so a part is either complete or missing
+    def _write_part(self, table, path):
+        import pyarrow.parquet as pq
+        temporary = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.tmp')
+        pq.write_table(table, temporary)
+        os.replace(temporary, path)
+
+    # columns are fixed by the first row, any extra column (e.g. mean score) just has to be in it
+    def append(self, row):
+        if self.fields is None:
+            self.fields = list(row.keys())
+        self.rows.append(row)
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.format == 'csv':
+            self._flush_csv()
+        else:
+            self._flush_parquet()
+        self.rows_written += len(self.rows)
+        self.rows = []
+
+    def _flush_csv(self):
+        if self._file is None:
+            self._file = open(self.path, 'w', newline='')
+            self._csv = csv.DictWriter(self._file, fieldnames=self.fields, lineterminator='\n')
+            self._csv.writeheader()
+        self._csv.writerows(self.rows)
+        self._file.flush()
+
+    # every flush becomes one complete Parquet file in the directory, the parts of an earlier
+    # run into the same directory are removed on the first one
+    def _flush_parquet(self):
+        import pyarrow as pa
+        if self._part is None:
+            os.makedirs(self.path, exist_ok=True)
+            for part in self._parts():
+                os.remove(part)
+            self._part = 0
+        table = pa.Table.from_pylist(self.rows, schema=self._schema)
+        self._schema = table.schema
+        self._write_part(table, os.path.join(self.path, f'part-{self._part:05d}.parquet'))
+        self._part += 1
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,124 @@
+"""
+neighborhood.py contains the precomputed neighbor index tables used by the simulation.
+A table is built once per (size, radius, topology) and shared by everything that needs
+neighbors, which then only has to gather from it.
+"""
+
+from functools import lru_cache
+import numpy as np
+
+TOPOLOGIES = ('toroidal', 'bounded')
+
+class NeighborTable:
+    def __init__(self, size, radius, topology='toroidal'):
+        if topology not in TOPOLOGIES:
+            raise ValueError(f"Unknown topology '{topology}', expected one of {TOPOLOGIES}")
+        self.size = size
+        self.radius = radius
+        self.topology = topology
+
+        # offsets in the same order as the original dx/dy loop
+        offsets = [(dx, dy) for dx in range(-radius, radius + 1) for dy in range(-radius, radius + 1)
+                   if dx != 0 or dy != 0]
+        cells = np.arange(size * size)
+        x, y = np.divmod(cells, size)
+        nx = np.stack([x + dx for dx, _ in offsets], axis=1)
+        ny = np.stack([y + dy for _, dy in offsets], axis=1)
+
+        if topology == 'toroidal':
+            # every slot is a real neighbor
+            self.indices = (nx % size) * size + ny % size
+            self.valid = None
+        else:
+            # slots that fall off the grid point back at the cell itself and are masked out
+            self.valid = (nx >= 0) & (nx < size) & (ny >= 0) & (ny < size)
+            self.indices = np.where(self.valid, nx * size + ny, cells[:, None])
+            self.valid.setflags(write=False)
+        self.indices.setflags(write=False)
+        self._rows = None
+
+    # variable-length layout: the real neighbors of every cell as a list of index arrays
+    @property
+    def rows(self):
+        if self._rows is None:
+            if self.valid is None:
+                self._rows = list(self.indices)
+            else:
+                self._rows = [row[mask] for row, mask in zip(self.indices, self.valid)]
+        return self._rows
+
+    # valid mask combined with an extra (n, k) condition, None meaning every slot is valid
+    def mask(self, condition=None):
+        if condition is None:
+            return self.valid
+        if self.valid is None:
+            return condition
+        return self.valid & condition
+
+# a few recent configurations are kept, a sweep over sizes and radii would otherwise hold on to
+# every table it built (one 1000x1000 grid at radius 5 alone is close to a gigabyte)
+@lru_cache(maxsize=8)
+def neighbor_table(size, radius, topology='toroidal'):
+    return NeighborTable(size, radius, topology)
+
+# pick one valid column per row uniformly at random, -1 where a row has none
+def pick_columns(candidates, valid, rng):
+    if valid is None:
+        return rng.integers(candidates.shape[1], size=len(candidates))
+    counts = valid.sum(axis=1)
+    choice = (rng.random(len(candidates)) * counts).astype(np.intp)
+    columns = (np.cumsum(valid, axis=1) > choice[:, None]).argmax(axis=1)
+    return np.where(counts > 0, columns, -1)
+
+# pick one valid candidate per row uniformly at random, -1 where a row has none
+def pick_neighbors(candidates, valid, rng):
+    columns = pick_columns(candidates, valid, rng)
+    picked = candidates[np.arange(len(candidates)), columns]
+    return np.where(columns >= 0, picked, -1)
+
+# partner draws for the well-mixed case (radius < 1), where any agent can meet any other. cells
+# are grouped by type once so every draw is a direct index computation, without rejection
+class WellMixed:
+    def __init__(self, types):
+        self.n = len(types)
+        self.order = np.argsort(types, kind='stable')
+        self.position = np.empty(self.n, dtype=np.intp)
+        self.position[self.order] = np.arange(self.n)
+        self.type_counts = np.bincount(types)
+        type_starts = np.concatenate([[0], np.cumsum(self.type_counts)[:-1]])
+        self.start = type_starts[types]
+        self.count = self.type_counts[types]
+        self.typed = len(self.type_counts) > 1
+
+    # a random other cell for every agent, of the same type or of a different type
+    def partners(self, rng, same_type=False):
+        draw = rng.random(self.n)
+        if same_type or not self.typed:
+            # uniform over the agent's own type block, skipping the agent itself
+            k = (draw * (self.count - 1)).astype(np.intp)
+            k += k >= self.position - self.start
+            cells = self.order[self.start + k]
+            return np.where(self.count > 1, cells, -1)
+        # uniform over every block but the agent's own
+        k = (draw * (self.n - self.count)).astype(np.intp)
+        k += np.where(k >= self.start, self.count, 0)
+        return self.order[k]
+
+    # a random perfect matching: partners[partners[i]] == i, -1 for agents left without a partner.
+    # typed games pair agents of the two types with each other
+    def matching(self, rng):
+        partners = np.full(self.n, -1, dtype=np.intp)
+        if not self.typed:
+            shuffled = rng.permutation(self.n)
+            first, second = shuffled[0:self.n - 1:2], shuffled[1::2]
+        elif len(self.type_counts) == 2:
+            split = self.type_counts[0]
+            first = rng.permutation(self.order[:split])
+            second = rng.permutation(self.order[split:])
+            pairs = min(len(first), len(second))
+            first, second = first[:pairs], second[:pairs]
+        else:
+            raise ValueError("Perfect matching supports untyped games or games with two agent types")
+        partners[first] = second
+        partners[second] = first
+        return partners
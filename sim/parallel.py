@@ -0,0 +1,264 @@
+"""
+parallel.py contains a multi-process version of the vectorized engine for very large grids.
+The grid is cut into horizontal strips (tiles) that are shared out over worker processes. All
+per-cell state lives in shared memory, so a worker reads the `radius` rows above and below its
+tiles (the halo) straight from the arrays its neighbors wrote, after a barrier that makes sure
+they are complete. Each iteration runs in three phases with a barrier after each:
+
+    1. every tile picks partners and actions for its cells
+    2. every tile scores its cells, as player and as the partner of a neighbor
+    3. every tile applies the learning dynamic and writes the new strategies
+
+Unlike VectorizedEngine, this is a synchronous model: every agent picks one action per iteration,
+from a history it keeps across iterations, and learns from the scores of the whole iteration.
+
+The random draws of a tile come from a generator seeded with (seed, tile, iteration), so the
+result depends on the number of tiles but not on the number of workers. Workers are forked and
+inherit the compiled strategy tables, which is why a start method with fork is required.
+"""
+
+import multiprocessing as mp
+import random
+import threading
+import weakref
+from multiprocessing import shared_memory
+import numpy as np
+from sim.engine import VectorizedEngine
+from sim.neighborhood import pick_neighbors
+
+_STEP = 1
+_STOP = 2
+_ENTROPY_WORDS = 8
+# fixed rather than derived from the worker count, so that the default result is the same
+# on every machine
+DEFAULT_TILES = 32
+
+# a NumPy array in a shared memory block, the block is kept alive by `blocks`
+def _shared_copy(array, blocks):
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(block)
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    shared[...] = array
+    return shared
+
+# stop the workers and release the shared memory. the arrays stay usable in this process, only
+# the names of the blocks are removed
+def _shutdown(processes, barrier, control, blocks):
+    if processes:
+        control[0] = _STOP
+        try:
+            barrier.wait(timeout=5)
+        except threading.BrokenBarrierError:
+            pass
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        processes.clear()
+    for block in blocks:
+        block.unlink()
+    blocks.clear()
+
+class ParallelEngine(VectorizedEngine):
+    def __init__(self, game_config, config, dynamic, agent_types=None, seed=None, workers=None, tiles=None):
+        if config.radius < 1:
+            raise ValueError("The parallel engine needs radius >= 1")
+        if config.size < 2 * config.radius + 1:
+            raise ValueError("The parallel engine needs a grid larger than the neighborhood")
+        if config.payoff_mode != 'pairwise':
+            raise ValueError("The parallel engine needs payoff_mode='pairwise'")
+        if 'fork' not in mp.get_all_start_methods():
+            raise ValueError("The parallel engine needs the 'fork' start method")
+        super().__init__(game_config, config, dynamic, agent_types, seed=seed)
+        self.tiles = self._tile_count(tiles)
+        # a worker without a tile would only wait at the barriers
+        self.workers = min(workers or mp.cpu_count(), self.tiles)
+        bounds = np.linspace(0, self.size, self.tiles + 1).astype(int)
+        self.tile_rows = list(zip(bounds[:-1], bounds[1:]))
+        self.iteration = 0
+
+        # move the state into shared memory
+        self._blocks = []
+        pop = self.population
+        pop.strategies = _shared_copy(pop.strategies, self._blocks)
+        pop._back = _shared_copy(pop._back, self._blocks)
+        pop.scores = _shared_copy(pop.scores, self._blocks)
+        for name in ('own', 'opp', 'head', 'length'):
+            setattr(pop.histories, name, _shared_copy(getattr(pop.histories, name), self._blocks))
+        self.buffers = (pop.strategies, pop._back)
+        self.actions_now = _shared_copy(np.zeros(self.n, dtype=np.int8), self._blocks)
+        self.partners_now = _shared_copy(np.full(self.n, -1, dtype=np.intp), self._blocks)
+        # per tile results that the main process adds up: score totals and count changes
+        self.tile_totals = _shared_copy(np.zeros(self.tiles), self._blocks)
+        self.tile_deltas = _shared_copy(np.zeros((self.tiles,) + pop.type_counts.shape, dtype=np.int64), self._blocks)
+        # command, iteration, which strategy buffer is current and the entropy every tile stream
+        # is derived from (set also when no seed was given) as 32 bit words
+        self.control = _shared_copy(np.zeros(3 + _ENTROPY_WORDS, dtype=np.int64), self._blocks)
+        self.entropy = np.random.SeedSequence(seed).entropy
+
+        context = mp.get_context('fork')
+        self.barrier = context.Barrier(self.workers + 1)
+        self.processes = [context.Process(target=self._work, args=(w,), daemon=True)
+                          for w in range(self.workers)]
+        for process in self.processes:
+            process.start()
+        self._finalizer = weakref.finalize(self, _shutdown, self.processes, self.barrier, self.control, self._blocks)
+
+    # strips must be at least one row high and leave room for the halo on both sides. the count
+    # never depends on the number of workers, which only decides who runs which tile
+    def _tile_count(self, tiles):
+        if tiles is None:
+            tiles = DEFAULT_TILES
+        limit = self.size if self.config.topology == 'bounded' else max(self.size - 2 * self.config.radius, 1)
+        return max(1, min(tiles, limit))
+
+    @property
+    def entropy(self):
+        words = [int(word) for word in self.control[3:]]
+        return sum(word << (32 * i) for i, word in enumerate(words))
+
+    @entropy.setter
+    def entropy(self, value):
+        value = int(value)
+        if value >> (32 * _ENTROPY_WORDS):
+            raise ValueError("Seed too large for the parallel engine")
+        self.control[3:] = [(value >> (32 * i)) & 0xFFFFFFFF for i in range(_ENTROPY_WORDS)]
+
+    def step(self):
+        self.iteration += 1
+        self.control[0] = _STEP
+        self.control[1] = self.iteration
+        self.control[2] = 0 if self.population.strategies is self.buffers[0] else 1
+        profiler = self.profiler
+        try:
+            self.barrier.wait()
+            # the phases end when every worker is done with them
+            for phase in ('partners', 'interact', 'learn'):
+                self.barrier.wait()
+                if profiler is not None:
+                    profiler.lap(phase)
+        except threading.BrokenBarrierError:
+            raise RuntimeError("A parallel engine worker failed") from None
+        pop = self.population
+        pop.strategies, pop._back = pop._back, pop.strategies
+        pop.type_counts += self.tile_deltas.sum(axis=0)
+        pop.total_score += self.tile_totals.sum()
+        if profiler is not None:
+            profiler.lap('count')
+
+    def close(self):
+        self._finalizer()
+
+    # worker process loop
+    def _work(self, worker):
+        tiles = [self._prepare_tile(t) for t in range(worker, self.tiles, self.workers)]
+        try:
+            while True:
+                self.barrier.wait()
+                if self.control[0] == _STOP:
+                    return
+                iteration = int(self.control[1])
+                entropy = self.entropy
+                current = self.buffers[self.control[2]]
+                back = self.buffers[1 - self.control[2]]
+                rngs = [np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(tile['index'], iteration)))
+                        for tile in tiles]
+                for tile, rng in zip(tiles, rngs):
+                    self._choose(tile, current, rng)
+                self.barrier.wait()
+                for tile in tiles:
+                    self._score(tile, current)
+                self.barrier.wait()
+                for tile, rng in zip(tiles, rngs):
+                    self._learn(tile, current, back, rng)
+                self.barrier.wait()
+        except Exception:
+            self.barrier.abort()
+            raise
+
+    # index arrays of one tile. learning works in a local index space of the tile's rows
+    # followed by its halo rows, so the batched dynamics see a small population
+    def _prepare_tile(self, t):
+        first, last = self.tile_rows[t]
+        radius = self.config.radius
+        rows = list(range(first, last))
+        halo = []
+        for row in list(range(first - radius, first)) + list(range(last, last + radius)):
+            if self.config.topology == 'toroidal':
+                row %= self.size
+            elif not 0 <= row < self.size:
+                continue
+            if row not in rows and row not in halo:
+                halo.append(row)
+        local_rows = np.array(rows + halo)
+        row_to_local = np.full(self.size, -1)
+        row_to_local[local_rows] = np.arange(len(local_rows))
+        cells = np.arange(first * self.size, last * self.size)
+        local_cells = (local_rows[:, None] * self.size + np.arange(self.size)).ravel()
+
+        neighbors = self.neighbors[cells]
+        pool = row_to_local[neighbors // self.size] * self.size + neighbors % self.size
+        # halo rows get a pool of themselves with no valid entry, so they keep their strategy
+        n_local, n_own = len(local_cells), len(cells)
+        pool = np.vstack([pool, np.repeat(np.arange(n_own, n_local)[:, None], pool.shape[1], axis=1)])
+        valid = np.zeros(pool.shape, dtype=bool)
+        valid[:n_own] = True if self.learn_valid is None else self.learn_valid[cells]
+        return {
+            'index': t,
+            'cells': cells,
+            'local_cells': local_cells,
+            'neighbors': neighbors,
+            'partner_valid': None if self.partner_valid is None else self.partner_valid[cells],
+            'pool': pool,
+            'valid': valid,
+        }
+
+    # phase 1: partners and actions of the tile's cells
+    def _choose(self, tile, strategies, rng):
+        cells = tile['cells']
+        self.partners_now[cells] = pick_neighbors(tile['neighbors'], tile['partner_valid'], rng)
+        if self.per_agent.any():
+            # strategies called per agent may draw from the random module
+            random.seed(int(rng.integers(2 ** 63)))
+        self.actions_now[cells] = self._actions(cells, strategies, rng)
+
+    # phase 2: payoffs of the tile's cells as player and as the chosen partner of a neighbor.
+    # only the tile and its halo can choose a cell of the tile
+    def _score(self, tile, strategies):
+        cells, local_cells = tile['cells'], tile['local_cells']
+        first = cells[0]
+        actions, partners = self.actions_now, self.partners_now
+        own_partners = partners[cells]
+        players = own_partners >= 0
+        total = np.zeros(len(cells))
+        total[players] = self.payoff_matrix[actions[cells[players]], actions[own_partners[players]], 0]
+        chosen = partners[local_cells]
+        inside = (chosen >= first) & (chosen < first + len(cells))
+        choosers, chosen = local_cells[inside], chosen[inside]
+        total += np.bincount(chosen - first, weights=self.payoff_matrix[actions[choosers], actions[chosen], 1],
+                             minlength=len(cells))
+        self.population.scores[cells] += total
+        self.tile_totals[tile['index']] = total.sum()
+        # both sides of every interaction of the tile's cells, in scan order of the player
+        player_cells = cells[players]
+        events = np.concatenate([player_cells, chosen])
+        opponents = np.concatenate([own_partners[players], choosers])
+        order = np.argsort(np.concatenate([player_cells, choosers]), kind='stable')
+        self.population.histories.push_all(events[order], actions[events[order]], actions[opponents[order]])
+
+    # phase 3: the learning dynamic on the tile plus halo, written to the back buffer
+    def _learn(self, tile, strategies, back, rng):
+        cells, local_cells = tile['cells'], tile['local_cells']
+        pop = self.population
+        new = self.update_rule(pop.scores[local_cells], strategies[local_cells], tile['pool'], tile['valid'], rng)
+        new = new[:len(cells)]
+        old = strategies[cells]
+        back[cells] = new
+        changed = new != old
+        pop.histories.clear(cells[changed])
+        n_strategies = pop.type_counts.shape[1]
+        size = pop.type_counts.size
+        types = pop.types[cells[changed]].astype(np.intp) * n_strategies
+        delta = (np.bincount(types + new[changed], minlength=size)
+                 - np.bincount(types + old[changed], minlength=size))
+        self.tile_deltas[tile['index']] = delta.reshape(pop.type_counts.shape)
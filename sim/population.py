@@ -0,0 +1,140 @@
+"""
+population.py contains the struct-of-arrays container used by the vectorized engine. Every
+attribute of an agent is one entry in a flat array indexed by cell, and AgentView exposes a
+single cell through the same interface as Agent for code that works on agents.
+"""
+
+import numpy as np
+from sim.history import HistoryArray
+
+class Population:
+    def __init__(self, size, strategies, types, strategy_list, agent_types, actions, history_depth, replicas=1):
+        self.size = size
+        # an ensemble stores its replicas one grid after the other
+        self.replicas = replicas
+        self.n = replicas * size * size
+        self.strategy_list = strategy_list
+        self.agent_types = agent_types
+        self.actions = actions
+
+        # strategy ids are double-buffered: an update is written to the back buffer, then swapped
+        self.strategies = np.asarray(strategies, dtype=np.int8)
+        self._back = np.empty_like(self.strategies)
+        self.types = np.asarray(types, dtype=np.int8)
+        self.scores = np.zeros(self.n)
+        self.prev_scores = np.zeros(self.n)
+        # agents per (type, strategy) and the sum of all scores, kept up to date on every change
+        self.n_types = max(len(agent_types), 1)
+        self.type_counts = np.zeros((self.n_types, len(strategy_list)), dtype=np.int64)
+        np.add.at(self.type_counts, (self.types, self.strategies), 1)
+        self.total_score = 0.0
+        # bounded interaction history of every agent as action ids
+        self.histories = HistoryArray(self.n, history_depth)
+        # cells whose strategy was set from outside a step, None when any cell may have changed
+        self.touched = None
+        self._agents = None
+
+    # make new_strategies the current strategies without allocating a new array. returns the
+    # mask of cells that changed strategy
+    def swap(self, new_strategies):
+        np.copyto(self._back, new_strategies, casting='unsafe')
+        changed = self._back != self.strategies
+        n_strategies = self.type_counts.shape[1]
+        size = self.type_counts.size
+        removed = np.bincount(self.types[changed] * n_strategies + self.strategies[changed], minlength=size)
+        added = np.bincount(self.types[changed] * n_strategies + self._back[changed], minlength=size)
+        self.type_counts += (added - removed).reshape(self.type_counts.shape)
+        self.strategies, self._back = self._back, self.strategies
+        return changed
+
+    # write new strategy ids for some cells in place. returns the cells that changed
+    def assign(self, cells, new_strategies):
+        old = self.strategies[cells]
+        changed = new_strategies != old
+        cells, old, new = cells[changed], old[changed], new_strategies[changed]
+        n_strategies = self.type_counts.shape[1]
+        size = self.type_counts.size
+        types = self.types[cells].astype(np.intp) * n_strategies
+        delta = np.bincount(types + new, minlength=size) - np.bincount(types + old, minlength=size)
+        self.type_counts += delta.reshape(self.type_counts.shape)
+        self.strategies[cells] = new
+        return cells
+
+    # add payoffs to the scores of the given cells, which may repeat
+    def add_scores(self, cells, payoffs):
+        self.scores += np.bincount(cells, weights=payoffs, minlength=self.n)
+        self.total_score += payoffs.sum()
+
+    def type_name(self, cell):
+        return self.agent_types[self.types[cell]] if self.agent_types else None
+
+    # history of one agent as a list of (my_action, their_action), at most `depth` long
+    def history(self, cell, depth=None):
+        return [(self.actions[own], self.actions[opp]) for own, opp in self.histories.window(cell, depth)]
+
+    # grid of AgentView objects, one grid per replica in an ensemble. the views are created once
+    # and always show the current state
+    def agents(self):
+        if self._agents is None:
+            shape = (self.size, self.size) if self.replicas == 1 else (self.replicas, self.size, self.size)
+            self._agents = np.empty(shape, dtype=object)
+            for cell in range(self.n):
+                self._agents.flat[cell] = AgentView(self, cell)
+        return self._agents
+
+# one cell of a Population with the interface of Agent. writes go to the population's arrays;
+# history is a snapshot, appending to it does not change the population
+class AgentView:
+    __slots__ = ('population', 'cell')
+
+    def __init__(self, population, cell):
+        self.population = population
+        self.cell = cell
+
+    @property
+    def strategy(self):
+        return self.population.strategy_list[self.population.strategies[self.cell]]
+
+    @strategy.setter
+    def strategy(self, strategy):
+        pop = self.population
+        new = pop.strategy_list.index(strategy)
+        pop.type_counts[pop.types[self.cell], pop.strategies[self.cell]] -= 1
+        pop.type_counts[pop.types[self.cell], new] += 1
+        pop.strategies[self.cell] = new
+        if pop.touched is not None:
+            pop.touched.append(self.cell)
+
+    @property
+    def score(self):
+        return self.population.scores[self.cell]
+
+    @score.setter
+    def score(self, score):
+        self.population.total_score += score - self.population.scores[self.cell]
+        self.population.scores[self.cell] = score
+
+    @property
+    def prev_score(self):
+        return self.population.prev_scores[self.cell]
+
+    @prev_score.setter
+    def prev_score(self, score):
+        self.population.prev_scores[self.cell] = score
+
+    @property
+    def type(self):
+        return self.population.type_name(self.cell)
+
+    @property
+    def position(self):
+        size = self.population.size
+        return divmod(self.cell % (size * size), size)
+
+    @property
+    def history(self):
+        return self.population.history(self.cell)
+
+    def reset_score(self):
+        self.prev_score = self.score
+        self.score = 0
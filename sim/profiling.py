@@ -0,0 +1,120 @@
+"""
+profiling.py contains the optional timing of the phases of an iteration. A Simulation with
+profiling on times its phases into a Profiler:
+
+    neighbors   neighbor lookup (object engine)
+    partners    partner selection
+    interact    actions, payoffs and histories
+    learn       the learning dynamic, or the update schedule
+    count       applying the new strategies and updating the strategy counts
+    iteration   the whole of run_iteration
+
+and the GUI and the headless runner add their own phases, e.g. render and metrics. The object
+engine times every agent, so its phases add up the laps of all agents of the iteration. Update
+schedules and active-set updates count the changes as they make them, which is timed as learn.
+
+Every phase keeps its time per iteration over the last `window` iterations, for the rolling
+mean and the percentiles, plus the total over the whole run. Profiling is off by default, and
+then the only cost is a check that the profiler is None once per phase.
+"""
+
+import json
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+import numpy as np
+
+# the phases in the order they are reported, any other phase follows them
+PHASES = ('neighbors', 'partners', 'interact', 'learn', 'count', 'iteration', 'render', 'metrics')
+PERCENTILES = (50, 90, 99)
+
+class Profiler:
+    def __init__(self, window=200):
+        self.window = window
+        self.samples = {}
+        self.totals = {}
+        self.counts = {}
+        # laps of the iteration being timed
+        self.laps = {}
+        self._start = None
+        self._last = None
+
+    # starts timing an iteration
+    def start(self):
+        self._start = self._last = time.perf_counter()
+
+    # adds the time since the last lap (or the start) to `phase`
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.laps[phase] = self.laps.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    # ends the iteration, its laps become one sample per phase
+    def finish(self):
+        now = time.perf_counter()
+        laps, self.laps = self.laps, {}
+        for phase, seconds in laps.items():
+            self.record(phase, seconds)
+        self.record('iteration', now - self._start)
+
+    # adds one sample of `seconds` to `phase`
+    def record(self, phase, seconds):
+        if phase not in self.samples:
+            self.samples[phase] = deque(maxlen=self.window)
+            self.totals[phase] = 0.0
+            self.counts[phase] = 0
+        self.samples[phase].append(seconds)
+        self.totals[phase] += seconds
+        self.counts[phase] += 1
+
+    # times the body of a with statement as one sample of `phase`
+    @contextmanager
+    def phase(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start)
+
+    def reset(self):
+        self.samples.clear()
+        self.totals.clear()
+        self.counts.clear()
+        self.laps = {}
+
+    # statistics of every phase in seconds: mean, percentiles and maximum over the window, the
+    # last sample, and the total and number of samples over the run
+    def summary(self):
+        order = {phase: i for i, phase in enumerate(PHASES)}
+        result = {}
+        for phase in sorted(self.samples, key=lambda p: (order.get(p, len(order)), p)):
+            # the GUI records from two threads, so work on a copy
+            samples = np.array(list(self.samples[phase]))
+            if len(samples) == 0:
+                continue
+            stats = {'mean': float(samples.mean())}
+            for q, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+                stats[f'p{q}'] = float(value)
+            stats['max'] = float(samples.max())
+            stats['last'] = float(samples[-1])
+            stats['total'] = self.totals[phase]
+            stats['count'] = self.counts[phase]
+            result[phase] = stats
+        return result
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'window': self.window, 'phases': self.summary()}, f, indent=4)
+
+    # the summary as a small table in milliseconds
+    def report(self):
+        lines = [f"{'phase':<10}{'mean':>8}{'p50':>8}{'p90':>8}{'p99':>8}  ms"]
+        for phase, stats in self.summary().items():
+            lines.append(f"{phase:<10}" + ''.join(f"{1000 * stats[key]:>8.2f}" for key in ('mean', 'p50', 'p90', 'p99')))
+        return '\n'.join(lines)
+
+# profiler.phase(name), or a context that does nothing when profiling is off
+def timed(profiler, phase):
+    if profiler is None:
+        return nullcontext()
+    return profiler.phase(phase)
@@ -0,0 +1,126 @@
+"""
+recording.py writes the strategy grid of a running simulation to a file, one uint8 frame of
+strategy ids per recorded iteration, and reads such recordings back for replay. The file starts
+with a small header (magic, frame count and the config as JSON) followed by the frames back to
+back. Both sides memory-map the frames, so recording is a copy into the map and seeking to any
+frame of a replay is instant, even when the recording is larger than RAM.
+"""
+
+import json
+import os
+import numpy as np
+
+MAGIC = b'GTPREC01'
+# magic, frame count (uint64) and header length (uint32), then the JSON header
+_FIXED = 20
+_ALIGN = 4096
+
+class Recorder:
+    # records the state of sim now and every `every` iterations after. the file grows by
+    # `chunk` frames at a time
+    def __init__(self, path, sim, every=1, chunk=256, **extra):
+        if every < 1:
+            raise ValueError("every must be at least 1")
+        self.path = path
+        self.every = every
+        self.chunk = chunk
+        self.size = sim.config.size
+        self.frame_size = self.size * self.size
+        self.start = sim.iteration
+        game_config = sim.game_config
+        header = {
+            'game_type': sim.game_type.name,
+            'strategies': [strategy.name for strategy in game_config.strategies],
+            'strategy_colors': game_config.strategy_colors,
+            'size': self.size,
+            'radius': sim.config.radius,
+            'topology': sim.config.topology,
+            'strategy_distribution': sim.config.strategy_distribution,
+            'dynamic': sim.dynamic.__name__,
+            'start_iteration': self.start,
+            'every': every,
+            **extra
+        }
+        data = json.dumps(header).encode()
+        self.offset = -(-(_FIXED + len(data)) // _ALIGN) * _ALIGN
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(np.uint64(0).tobytes())
+            f.write(np.uint32(len(data)).tobytes())
+            f.write(data)
+            f.truncate(self.offset)
+        self.count = 0
+        self.capacity = 0
+        self._frames = None
+        self._count = np.memmap(path, dtype=np.uint64, mode='r+', offset=len(MAGIC), shape=(1,))
+        self.record(sim)
+
+    # record the current grid if it is one of the recorded iterations
+    def record(self, sim):
+        if (sim.iteration - self.start) % self.every:
+            return
+        if self.count == self.capacity:
+            self._grow()
+        self._frames[self.count] = sim.strategy_grid()
+        self.count += 1
+        self._count[0] = self.count
+
+    def _grow(self):
+        if self._frames is not None:
+            self._frames.flush()
+            self._frames = None
+        self.capacity += self.chunk
+        with open(self.path, 'r+b') as f:
+            f.truncate(self.offset + self.capacity * self.frame_size)
+        self._frames = np.memmap(self.path, dtype=np.uint8, mode='r+', offset=self.offset,
+                                 shape=(self.capacity, self.size, self.size))
+
+    # flush and cut the file down to the recorded frames
+    def close(self):
+        if self._frames is not None:
+            self._frames.flush()
+            self._frames = None
+        self._count.flush()
+        self._count = None
+        with open(self.path, 'r+b') as f:
+            f.truncate(self.offset + self.count * self.frame_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Recording:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            fixed = f.read(_FIXED)
+            if fixed[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a recording")
+            count = int(np.frombuffer(fixed[8:16], dtype=np.uint64)[0])
+            length = int(np.frombuffer(fixed[16:20], dtype=np.uint32)[0])
+            self.header = json.loads(f.read(length).decode())
+        self.size = self.header['size']
+        self.every = self.header['every']
+        self.start = self.header['start_iteration']
+        offset = -(-(_FIXED + length) // _ALIGN) * _ALIGN
+        # a recording that was not closed may have fewer frames on disk than counted
+        on_disk = (os.path.getsize(path) - offset) // (self.size * self.size)
+        self.frames = np.memmap(path, dtype=np.uint8, mode='r', offset=offset,
+                                shape=(min(count, on_disk), self.size, self.size))
+
+    def __len__(self):
+        return len(self.frames)
+
+    # strategy ids of frame i as a (size, size) array, read from disk on access
+    def __getitem__(self, i):
+        return self.frames[i]
+
+    def iteration(self, i):
+        return self.start + i * self.every
+
+    # strategy name -> count for frame i
+    def counts(self, i):
+        counts = np.bincount(self.frames[i].ravel(), minlength=len(self.header['strategies']))
+        return {name: int(count) for name, count in zip(self.header['strategies'], counts)}
@@ -0,0 +1,30 @@
+"""
+results.py contains the methods used to save simulation results into the 'results' directory.
+They are shared by the GUI and the headless runner so both write the same files.
+"""
+
+import datetime
+import json
+import os
+
+# create output directory with timestamp
+def make_output_dir(game_type, root="results"):
+    date_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_dir = os.path.join(root, f"{date_str}_{game_type.name}")
+    os.makedirs(output_dir, exist_ok=True)
+    return output_dir
+
+# save configuration, extra keys are added after the standard ones
+def save_config(output_dir, game_type, sim, total_iterations, **extra):
+    config = {
+        'game_type': game_type.name,
+        'grid_size': sim.config.size,
+        'radius': sim.config.radius,
+        'mobility': sim.config.mobility,
+        'topology': sim.config.topology,
+        'total_iterations': total_iterations,
+        'strategy_distribution': sim.config.strategy_distribution,
+        **extra
+    }
+    with open(os.path.join(output_dir, "config.json"), 'w') as f:
+        json.dump(config, f, indent=4)
@@ -0,0 +1,223 @@
+"""
+run.py runs a simulation from the command line without the GUI, as fast as the engine allows.
+It writes the same metrics.csv and config.json as the GUI's "Save Metrics" option.
+
+    python -m sim.run --game PD --dynamic replicator --radius 1 --size 50 --iterations 500 --seed 1
+"""
+
+import argparse
+import json
+import os
+from simulation import Simulation, SpatialConfig, PAYOFF_MODES
+from sim.game import GameType
+from sim.dynamics import LearningDynamic
+from sim.results import make_output_dir, save_config
+from sim.metrics import MetricsWriter, resolve_format
+from sim.stability import StabilityDetector
+from sim.cycles import CycleDetector, is_absorbing
+from sim.checkpoint import save_checkpoint, load_checkpoint
+from sim.recording import Recorder
+from sim.schedule import SCHEDULES
+from sim.profiling import timed
+
+DYNAMICS = ['replicator', 'fermi', 'moran', 'random_copy', 'aspiration']
+
+# accepts either a JSON object or "Name=0.5,Other Name=0.5"
+def parse_distribution(text):
+    text = text.strip()
+    if text.startswith('{'):
+        return {name: float(value) for name, value in json.loads(text).items()}
+    distribution = {}
+    for item in text.split(','):
+        name, value = item.split('=')
+        distribution[name.strip()] = float(value)
+    return distribution
+
+def build_simulation(game_type, dynamic, radius=1, size=50, distribution=None, topology='toroidal',
+                     engine='object', seed=None, matching='independent', workers=None,
+                     active_set=False, schedule='synchronous', payoff_mode='pairwise', profile=False):
+    game_config = game_type.value
+    config = SpatialConfig(
+        size=size,
+        radius=radius,
+        mobility=0.0,
+        topology=topology,
+        strategy_distribution=distribution or game_config.default_distribution,
+        matching=matching,
+        payoff_mode=payoff_mode
+    )
+    return Simulation(
+        game_type=game_type,
+        config=config,
+        dynamic=getattr(LearningDynamic, dynamic),
+        agent_types=game_config.agent_types or [],
+        engine=engine,
+        seed=seed,
+        workers=workers,
+        active_set=active_set,
+        schedule=schedule,
+        profile=profile
+    )
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a simulation without the GUI.")
+    parser.add_argument('--game', choices=[gt.name for gt in GameType], default='PD')
+    parser.add_argument('--dynamic', choices=DYNAMICS, default='replicator')
+    parser.add_argument('--radius', type=int, default=1)
+    parser.add_argument('--size', type=int, default=50)
+    parser.add_argument('--distribution', type=parse_distribution, default=None,
+                        help='strategy proportions, e.g. "Cooperate=0.5,Defect=0.25,TitForTat=0.25"')
+    parser.add_argument('--topology', choices=['toroidal', 'bounded'], default='toroidal')
+    parser.add_argument('--matching', choices=['independent', 'perfect'], default='independent',
+                        help='partner draws when radius < 1: independent per agent or a random perfect pairing')
+    parser.add_argument('--payoff-mode', choices=PAYOFF_MODES, default='pairwise',
+                        help="'pairwise' plays one random neighbor per iteration, 'total' and 'expected' the sum "
+                             "and the mean over every neighbor (fast for any radius)")
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--engine', choices=['object', 'vectorized', 'parallel'], default='object',
+                        help="'object' is the GUI's engine and gives the same results as the GUI; 'vectorized' "
+                             "runs the same model much faster on large grids (see sim/engine.py); 'parallel' "
+                             "splits a synchronous model over processes (see sim/parallel.py)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes of the parallel engine (default: one per CPU)')
+    parser.add_argument('--active-set', action='store_true',
+                        help='only update cells next to a different strategy, faster once regions settle')
+    parser.add_argument('--schedule', choices=SCHEDULES, default='synchronous',
+                        help="order of the strategy updates: all at once, one random agent at a time, or "
+                             "'event' to simulate only the updates that can change a strategy")
+    parser.add_argument('--metrics-format', choices=['csv', 'parquet', 'auto'], default='csv',
+                        help="'auto' writes Parquet when pyarrow is installed, as a directory with one file per flush")
+    parser.add_argument('--flush-every', type=int, default=100, help='iterations buffered between writes')
+    parser.add_argument('--mean-score', action='store_true', help='also record the mean score per iteration')
+    parser.add_argument('--stop-when-stable', action='store_true',
+                        help='end the run once every strategy count stays within the stability range')
+    parser.add_argument('--stability-range', type=float, default=30,
+                        help='largest change in a strategy count that still counts as stable')
+    parser.add_argument('--stability-iterations', type=int, default=50,
+                        help='number of iterations the counts must stay within the range')
+    parser.add_argument('--relative-range', action='store_true',
+                        help='the stability range is a proportion of the population (e.g. 0.01)')
+    parser.add_argument('--detect-cycles', action='store_true',
+                        help='report repeated states and end the run in an absorbing state')
+    parser.add_argument('--cycle-memory', type=int, default=256,
+                        help='number of recent states kept, the longest cycle that can be found')
+    parser.add_argument('--jump-ahead', action='store_true',
+                        help='with --detect-cycles, fill in the remaining iterations instead of ending early')
+    parser.add_argument('--checkpoint-every', type=int, default=0,
+                        help='save the full simulation state to checkpoint.npz every N iterations')
+    parser.add_argument('--record-every', type=int, default=0,
+                        help='write the strategy grid of every N-th iteration to trajectory.gtprec for replay')
+    parser.add_argument('--resume', default=None, metavar='CHECKPOINT',
+                        help='continue from a checkpoint up to --iterations, the game and grid options are taken from it')
+    parser.add_argument('--profile', action='store_true',
+                        help='time the phases of every iteration, print them at the end and save profile.json')
+    parser.add_argument('--output-dir', default=None,
+                        help='directory for metrics.csv and config.json (default: results/<timestamp>_<game>)')
+    args = parser.parse_args(argv)
+    if args.jump_ahead and args.mean_score:
+        parser.error("--jump-ahead cannot extrapolate --mean-score, scores keep changing in a fixed state")
+    if args.detect_cycles and args.cycle_memory < 1:
+        parser.error("--cycle-memory must be at least 1")
+    if args.engine == 'object' and not args.resume:
+        for option, used in (('--active-set', args.active_set), ('--schedule', args.schedule != 'synchronous'),
+                             ('--payoff-mode', args.payoff_mode != 'pairwise'), ('--matching', args.matching != 'independent')):
+            if used:
+                parser.error(f"{option} needs --engine vectorized")
+    return args
+
+# checks the state after `iteration` for a repeat, returns True once the run is confirmed to
+# stay in it
+def check_cycles(cycles, sim, iteration, counts):
+    reported = cycles.repeat is not None
+    repeat = cycles.update(iteration, sim.strategy_grid(), counts)
+    if repeat is None:
+        return False
+    if repeat.fixed_point and is_absorbing(sim):
+        cycles.confirm(repeat)
+        print(f"Absorbing state reached: {repeat}")
+        return True
+    if not reported:
+        print(f"State repeated: {repeat}, continuing")
+    return False
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.resume:
+        sim = load_checkpoint(args.resume)
+        game_type = sim.game_type
+        args.dynamic = sim.dynamic.__name__
+        args.engine = sim.engine_name
+        args.schedule = getattr(sim.engine, 'schedule', 'synchronous')
+        args.seed = sim.seed
+        sim.set_profiling(args.profile)
+        print(f"Resuming from iteration {sim.iteration}")
+    else:
+        game_type = GameType[args.game]
+        sim = build_simulation(game_type, args.dynamic, args.radius, args.size, args.distribution,
+                               args.topology, args.engine, args.seed, args.matching, args.workers,
+                               args.active_set, args.schedule, args.payoff_mode, args.profile)
+
+    output_dir = args.output_dir
+    if output_dir is None:
+        output_dir = make_output_dir(game_type)
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+
+    metrics_format = resolve_format(args.metrics_format)
+    metrics_path = os.path.join(output_dir, f"metrics.{metrics_format}")
+    stability = StabilityDetector(args.stability_range, args.stability_iterations,
+                                  relative=args.relative_range, population=sim.config.size ** 2)
+    cycles = CycleDetector(args.cycle_memory) if args.detect_cycles else None
+    checkpoint_path = os.path.join(output_dir, "checkpoint.npz")
+    recorder = None
+    if args.record_every:
+        recorder = Recorder(os.path.join(output_dir, "trajectory.gtprec"), sim, args.record_every,
+                            engine=args.engine, seed=args.seed)
+    iteration = sim.iteration
+    resume_after = sim.iteration if args.resume else None
+    with MetricsWriter(metrics_path, args.flush_every, metrics_format, resume_after) as writer:
+        for iteration in range(sim.iteration + 1, args.iterations + 1):
+            sim.run_iteration()
+            if recorder is not None:
+                with timed(sim.profiler, 'recording'):
+                    recorder.record(sim)
+            if args.checkpoint_every and iteration % args.checkpoint_every == 0:
+                with timed(sim.profiler, 'checkpoint'):
+                    save_checkpoint(sim, checkpoint_path)
+            counts = sim.strategy_counts()
+            row = {'iteration': iteration, **counts}
+            if args.mean_score:
+                row['mean_score'] = sim.mean_score()
+            if args.schedule != 'synchronous':
+                row['mc_time'] = sim.mc_time()
+                row['update_events'] = sim.update_events()
+            with timed(sim.profiler, 'metrics'):
+                writer.append(row)
+            if stability.update(counts) and args.stop_when_stable:
+                break
+            if cycles is not None and check_cycles(cycles, sim, iteration, counts):
+                if args.jump_ahead:
+                    # the rest of the run is known without simulating it
+                    for later in range(iteration + 1, args.iterations + 1):
+                        writer.append({'iteration': later, **cycles.predict(later)})
+                    iteration = args.iterations
+                break
+
+    if recorder is not None:
+        recorder.close()
+    sim.close()
+    if stability.reached:
+        print(f"Stability reached at iteration {stability.stable_at}")
+    save_config(output_dir, game_type, sim, iteration,
+                dynamic=args.dynamic, engine=args.engine, seed=args.seed, schedule=args.schedule,
+                payoff_mode=sim.config.payoff_mode,
+                stable_at=stability.stable_at, simulated_iterations=sim.iteration,
+                cycle=cycles.repeat.as_dict() if cycles is not None and cycles.repeat else None)
+    if sim.profiler is not None:
+        sim.profiler.to_json(os.path.join(output_dir, "profile.json"))
+        print(sim.profiler.report())
+    print(f"Simulation data saved to {output_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+schedule.py contains the asynchronous update schedules of the vectorized engine. In the default
+synchronous schedule every agent updates its strategy at the same time, from the scores of the
+iteration. An asynchronous schedule instead updates one agent at a time, and every update sees
+the strategies the earlier ones produced.
+
+Both schedules keep the interaction of the engine: every agent plays once per iteration, then
+one unit of Monte Carlo time of single-agent strategy updates follows, so one iteration is one
+Monte Carlo step (on average one update per agent) in every schedule.
+
+    random_sequential   n updates of uniformly drawn agents per iteration
+    event               continuous time: every agent updates at rate 1, but only the agents
+                        that can change are simulated (see below)
+
+The event schedule is the n-fold way (Gillespie algorithm) over the strategy updates. Every
+built-in dynamic copies the strategy of the agent or of a neighbor it can learn from, so an
+update of an agent whose neighbors all share its strategy cannot change anything and is
+skipped exactly. The others, the frontier, update at total rate |frontier|: the time to the next
+event is exponential with that rate and the agent is drawn uniformly from the frontier. Near
+fixation the frontier is a small part of the grid, so an iteration costs a handful of events
+instead of one update per agent.
+
+Single updates are too small to gain from NumPy, so they call the per-agent LearningDynamic rule
+on the population's AgentViews and draw from the random module, like the object path does. The
+random module is seeded from the engine's generator when the schedule is created.
+"""
+
+import random
+import numpy as np
+from sim.cycles import IMITATION_DYNAMICS
+from sim.neighborhood import neighbor_table
+
+SCHEDULES = ('synchronous', 'random_sequential', 'event')
+
+# cells in a set that can be sampled uniformly, with constant time add and remove
+class CellSet:
+    def __init__(self, n):
+        self.cells = []
+        self.position = np.full(n, -1, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self, cell):
+        return self.position[cell] >= 0
+
+    def add(self, cell):
+        if self.position[cell] < 0:
+            self.position[cell] = len(self.cells)
+            self.cells.append(cell)
+
+    def discard(self, cell):
+        i = self.position[cell]
+        if i < 0:
+            return
+        last = self.cells.pop()
+        if last != cell:
+            self.cells[i] = last
+            self.position[last] = i
+        self.position[cell] = -1
+
+    def sample(self):
+        return self.cells[random.randrange(len(self.cells))]
+
+class AsyncSchedule:
+    def __init__(self, engine):
+        if engine.well_mixed:
+            raise ValueError("Asynchronous schedules need radius >= 1")
+        if engine.neighborhood:
+            raise ValueError("Asynchronous schedules need payoff_mode='pairwise'")
+        self.engine = engine
+        # strategy updates that were evaluated
+        self.events = 0
+        config = engine.config
+        self.rows = neighbor_table(config.size, config.radius, config.topology).rows
+        self.agents = list(engine.population.agents().flat)
+        self.strategy_ids = {strategy: i for i, strategy in enumerate(engine.game_config.strategies)}
+        random.seed(int(engine.rng.integers(2 ** 63)))
+
+    # applies the learning dynamic to one cell, returns True when its strategy changed
+    def update(self, cell):
+        pop = self.engine.population
+        self.events += 1
+        agents = self.agents
+        new = self.strategy_ids[self.engine.dynamic(agents[cell], [agents[j] for j in self.rows[cell]])]
+        old = pop.strategies[cell]
+        if new == old:
+            return False
+        pop.type_counts[pop.types[cell], old] -= 1
+        pop.type_counts[pop.types[cell], new] += 1
+        pop.strategies[cell] = new
+        pop.histories.clear(cell)
+        return True
+
+class RandomSequential(AsyncSchedule):
+    # one Monte Carlo step of updates
+    def learn(self):
+        n = self.engine.n
+        for _ in range(n):
+            self.update(random.randrange(n))
+        self.engine.population.touched = []
+
+class EventDriven(AsyncSchedule):
+    def __init__(self, engine):
+        if engine.dynamic.__name__ not in IMITATION_DYNAMICS:
+            raise ValueError(f"The event schedule needs an imitation dynamic, not '{engine.dynamic.__name__}'")
+        super().__init__(engine)
+        self.frontier = CellSet(engine.n)
+
+    # one unit of Monte Carlo time of updates
+    def learn(self):
+        engine = self.engine
+        pop = engine.population
+        if pop.touched is None:
+            self._refresh(np.arange(engine.n))
+        elif len(pop.touched):
+            self._refresh(np.asarray(pop.touched, dtype=np.intp))
+        pop.touched = []
+        # the waiting time is memoryless, so the event that falls past the end is simply dropped
+        time = 0.0
+        while len(self.frontier):
+            time += random.expovariate(len(self.frontier))
+            if time >= 1:
+                break
+            cell = self.frontier.sample()
+            if self.update(cell):
+                self._refresh(np.array([cell]))
+
+    # a change of strategy can only move the frontier at the cell and its neighbors
+    def _refresh(self, cells):
+        engine = self.engine
+        around = np.unique(np.concatenate([cells, engine.neighbors[cells].ravel()]))
+        for cell, mixed in zip(around.tolist(), engine._mixed(around).tolist()):
+            if mixed:
+                self.frontier.add(cell)
+            else:
+                self.frontier.discard(cell)
+
+# the schedule object for a name, None for the synchronous schedule
+def make_schedule(name, engine):
+    if name == 'synchronous':
+        return None
+    if name == 'random_sequential':
+        return RandomSequential(engine)
+    if name == 'event':
+        return EventDriven(engine)
+    raise ValueError(f"Unknown schedule '{name}', expected one of {SCHEDULES}")
@@ -0,0 +1,78 @@
+"""
+stability.py detects when a simulation has settled: every strategy count stayed within a
+range for a window of iterations. The rolling minimum and maximum of each count are kept in
+monotonic deques, so every update is O(1) per strategy regardless of the window length.
+"""
+
+from collections import deque
+
+# rolling min and max of the last `window` values
+class RollingRange:
+    def __init__(self, window):
+        self.window = window
+        self.count = 0
+        # (index, value) pairs, values decreasing in _max and increasing in _min
+        self._max = deque()
+        self._min = deque()
+
+    def push(self, value):
+        i = self.count
+        self.count += 1
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((i, value))
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((i, value))
+        # drop what fell out of the window
+        if self._max[0][0] <= i - self.window:
+            self._max.popleft()
+        if self._min[0][0] <= i - self.window:
+            self._min.popleft()
+
+    @property
+    def full(self):
+        return self.count >= self.window
+
+    def spread(self):
+        return self._max[0][1] - self._min[0][1]
+
+class StabilityDetector:
+    # stable once every strategy count varied by at most stability_range over the last
+    # stability_iterations iterations. with relative=True the range is a proportion of the
+    # population instead of a number of agents
+    def __init__(self, stability_range=30, stability_iterations=50, relative=False, population=None):
+        if stability_iterations < 1:
+            raise ValueError("stability_iterations must be at least 1")
+        if relative and not population:
+            raise ValueError("A relative stability range needs the population size")
+        self.stability_range = stability_range
+        self.stability_iterations = stability_iterations
+        self.relative = relative
+        self.population = population
+        self.threshold = stability_range * population if relative else stability_range
+        self.reset()
+
+    def reset(self):
+        self.ranges = {}
+        self.iteration = 0
+        # iteration at which stability was first reached, None until then
+        self.stable_at = None
+
+    # record the counts (strategy name -> count) of one iteration, returns True while stable
+    def update(self, counts):
+        self.iteration += 1
+        stable = True
+        for strategy, count in counts.items():
+            rolling = self.ranges.get(strategy)
+            if rolling is None:
+                rolling = self.ranges[strategy] = RollingRange(self.stability_iterations)
+            rolling.push(count)
+            stable = stable and rolling.full and rolling.spread() <= self.threshold
+        if stable and self.stable_at is None:
+            self.stable_at = self.iteration
+        return stable
+
+    @property
+    def reached(self):
+        return self.stable_at is not None
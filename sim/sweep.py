@@ -0,0 +1,166 @@
+"""
+sweep.py runs many simulations over a grid of configurations on a process pool and collects
+the strategy proportions of every run into one tidy table (CSV, or Parquet with pyarrow), one row
+per (run, iteration, strategy). Rows are written as runs finish so memory stays bounded.
+
+    python -m sim.sweep --games PD SH --dynamics replicator fermi --radii 1 2 3 --replicates 5 --output sweep.csv
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from sim.game import GameType
+from sim.run import DYNAMICS, build_simulation, parse_distribution
+from sim.metrics import MetricsWriter
+from sim.stability import StabilityDetector
+from sim.cycles import CycleDetector, is_absorbing
+
+FIELDS = ['run', 'game', 'dynamic', 'radius', 'size', 'topology', 'distribution', 'seed',
+          'iteration', 'strategy', 'proportion']
+
+# every combination of the given values. a distribution only applies to games that have all of
+# its strategies, None stands for the game's default distribution
+def expand_grid(games, dynamics, radii, distributions=(None,), replicates=1, size=50, iterations=100,
+                topology='toroidal', seed=0, record_every=1, stop_when_stable=False,
+                stability_range=30, stability_iterations=50, relative_range=False, detect_cycles=False,
+                engine='object'):
+    configs = []
+    for game, dynamic, radius, distribution in itertools.product(games, dynamics, radii, distributions):
+        game_type = GameType[game] if isinstance(game, str) else game
+        names = {strategy.name for strategy in game_type.value.strategies}
+        if distribution and not set(distribution) <= names:
+            continue
+        for replicate in range(replicates):
+            configs.append({
+                'run': len(configs),
+                'game': game_type.name,
+                'dynamic': dynamic,
+                'radius': radius,
+                'size': size,
+                'topology': topology,
+                'engine': engine,
+                'distribution': distribution,
+                'seed': seed + replicate,
+                'iterations': iterations,
+                'record_every': record_every,
+                'stop_when_stable': stop_when_stable,
+                'stability_range': stability_range,
+                'stability_iterations': stability_iterations,
+                'relative_range': relative_range,
+                'detect_cycles': detect_cycles
+            })
+    return configs
+
+# runs one configuration and returns its rows of the tidy table
+def run_config(config):
+    game_type = GameType[config['game']]
+    sim = build_simulation(game_type, config['dynamic'], config['radius'], config['size'],
+                           config['distribution'], config['topology'], config.get('engine', 'object'),
+                           config['seed'])
+    total = config['size'] ** 2
+    label = json.dumps(config['distribution']) if config['distribution'] else 'default'
+    key = [config['run'], config['game'], config['dynamic'], config['radius'], config['size'],
+           config['topology'], label, config['seed']]
+
+    stability = None
+    if config.get('stop_when_stable'):
+        stability = StabilityDetector(config['stability_range'], config['stability_iterations'],
+                                      relative=config['relative_range'], population=total)
+
+    cycles = CycleDetector() if config.get('detect_cycles') else None
+
+    rows = []
+
+    def record(iteration, counts, last):
+        # the time series is thinned by record_every, the final iteration is always kept
+        if iteration % config['record_every'] == 0 or last:
+            for strategy, count in counts.items():
+                rows.append(dict(zip(FIELDS, key + [iteration, strategy, count / total])))
+
+    for iteration in range(1, config['iterations'] + 1):
+        sim.run_iteration()
+        counts = sim.strategy_counts()
+        # settled runs end early, their last row is the final state
+        last = iteration == config['iterations'] or (stability is not None and stability.update(counts))
+        if not last and cycles is not None:
+            repeat = cycles.update(iteration, sim.strategy_grid(), counts)
+            if repeat is not None and repeat.fixed_point and is_absorbing(sim):
+                cycles.confirm(repeat)
+                # the rest of an absorbed run is known without simulating it
+                record(iteration, counts, False)
+                for later in range(iteration + 1, config['iterations'] + 1):
+                    record(later, cycles.predict(later), later == config['iterations'])
+                break
+        record(iteration, counts, last)
+        if last:
+            break
+    return rows
+
+# runs every configuration, keeping at most max_pending runs queued so results are written out
+# as they arrive. returns the number of finished runs
+def run_sweep(configs, output, workers=None, max_pending=None, progress=True, format='csv', flush_every=10000):
+    workers = workers or os.cpu_count()
+    max_pending = max_pending or 2 * workers
+    pending = iter(configs)
+    done = 0
+    start = time.time()
+
+    with MetricsWriter(output, flush_every, format) as writer, ProcessPoolExecutor(max_workers=workers) as pool:
+        running = {pool.submit(run_config, config) for config in itertools.islice(pending, max_pending)}
+        while running:
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                for row in future.result():
+                    writer.append(row)
+                done += 1
+            running |= {pool.submit(run_config, config) for config in itertools.islice(pending, len(finished))}
+            if progress:
+                elapsed = time.time() - start
+                print(f"\r[{done}/{len(configs)}] {elapsed:.1f}s elapsed", end='', file=sys.stderr, flush=True)
+    if progress:
+        print(file=sys.stderr)
+    return done
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a parameter sweep on a process pool.")
+    parser.add_argument('--games', nargs='+', choices=[gt.name for gt in GameType], default=[gt.name for gt in GameType])
+    parser.add_argument('--dynamics', nargs='+', choices=DYNAMICS, default=DYNAMICS)
+    parser.add_argument('--radii', nargs='+', type=int, default=[1])
+    parser.add_argument('--distributions', nargs='+', type=parse_distribution, default=[None],
+                        help='one or more distributions, each like "Cooperate=0.5,Defect=0.5"')
+    parser.add_argument('--replicates', type=int, default=1)
+    parser.add_argument('--size', type=int, default=50)
+    parser.add_argument('--topology', choices=['toroidal', 'bounded'], default='toroidal')
+    parser.add_argument('--engine', choices=['object', 'vectorized'], default='object',
+                        help="'object' is the GUI's engine, 'vectorized' runs the same model faster on large grids")
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--record-every', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first replicate')
+    parser.add_argument('--stop-when-stable', action='store_true',
+                        help='end each run once its strategy counts stay within the stability range')
+    parser.add_argument('--stability-range', type=float, default=30)
+    parser.add_argument('--stability-iterations', type=int, default=50)
+    parser.add_argument('--relative-range', action='store_true',
+                        help='the stability range is a proportion of the population (e.g. 0.01)')
+    parser.add_argument('--detect-cycles', action='store_true',
+                        help='stop simulating runs that reached an absorbing state and fill in their remaining rows')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--format', choices=['csv', 'parquet', 'auto'], default='csv')
+    parser.add_argument('--output', default='sweep.csv')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    configs = expand_grid(args.games, args.dynamics, args.radii, args.distributions, args.replicates,
+                          args.size, args.iterations, args.topology, args.seed, args.record_every,
+                          args.stop_when_stable, args.stability_range, args.stability_iterations,
+                          args.relative_range, args.detect_cycles, args.engine)
+    run_sweep(configs, args.output, args.workers, format=args.format)
+    print(f"Sweep of {len(configs)} runs saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+window.py contains whole-grid operations over the square (2r+1) x (2r+1) neighborhood of every
+cell, without a neighbor table. Sums use cumulative sums along the rows and then the columns, and
+maxima a doubling (sparse table) scheme along each axis, so their cost hardly grows with the
+radius: O(n) for a sum and O(n log r) for a maximum, where a neighbor table needs O(n r^2)
+memory and time. Toroidal grids are padded by wrapping around, bounded grids with cells that
+count for nothing.
+
+The results count every slot of the neighborhood like NeighborTable does, so on a toroidal grid
+that is smaller than the neighborhood a cell that is reached through several offsets counts
+several times.
+"""
+
+import numpy as np
+from sim.neighborhood import TOPOLOGIES
+
+class Window:
+    def __init__(self, size, radius, topology, types):
+        if topology not in TOPOLOGIES:
+            raise ValueError(f"Unknown topology '{topology}', expected one of {TOPOLOGIES}")
+        if radius < 1:
+            raise ValueError("A neighborhood window needs radius >= 1")
+        self.size = size
+        self.radius = radius
+        self.topology = topology
+        self.n = size * size
+        self.types = np.asarray(types)
+        self.n_types = int(self.types.max()) + 1
+        # offsets in the same order as NeighborTable
+        self.offsets = np.array([(dx, dy) for dx in range(-radius, radius + 1) for dy in range(-radius, radius + 1)
+                                 if dx != 0 or dy != 0])
+        self.x, self.y = np.divmod(np.arange(self.n), size)
+
+        # neighbors of the same type (excluding the cell itself) and of another type
+        type_planes = np.zeros((self.n_types, self.n))
+        type_planes[self.types, np.arange(self.n)] = 1
+        by_type = self.box_sum(type_planes.reshape(self.n_types, size, size)).reshape(self.n_types, self.n)
+        self.same_counts = np.rint(by_type[self.types, np.arange(self.n)]).astype(np.int64) - 1
+        self.other_counts = np.rint(by_type.sum(axis=0)).astype(np.int64) - 1 - self.same_counts
+
+    # the counts of neighbors a cell can learn from and play with
+    @property
+    def learn_counts(self):
+        return self.same_counts if self.n_types > 1 else self.same_counts + self.other_counts
+
+    @property
+    def partner_counts(self):
+        return self.other_counts if self.n_types > 1 else self.same_counts + self.other_counts
+
+    def _pad(self, a, fill):
+        r = self.radius
+        pad = [(0, 0)] * (a.ndim - 1) + [(r, r)]
+        if self.topology == 'toroidal':
+            return np.pad(a, pad, mode='wrap')
+        return np.pad(a, pad, mode='constant', constant_values=fill)
+
+    # sums over a window of 2r + 1 along the last axis
+    def _sum_1d(self, a):
+        padded = self._pad(a, 0)
+        cumulative = np.cumsum(padded, axis=-1)
+        cumulative = np.concatenate([np.zeros(a.shape[:-1] + (1,)), cumulative], axis=-1)
+        width, length = 2 * self.radius + 1, a.shape[-1]
+        return cumulative[..., width:width + length] - cumulative[..., :length]
+
+    # maxima over a window of 2r + 1 along the last axis
+    def _max_1d(self, a):
+        padded = self._pad(a, -np.inf)
+        width, length = 2 * self.radius + 1, a.shape[-1]
+        # after the loop, padded[j] is the maximum of `span` values starting at j
+        span = 1
+        while span * 2 <= width:
+            padded = np.maximum(padded[..., :-span], padded[..., span:])
+            span *= 2
+        return np.maximum(padded[..., :length], padded[..., width - span:width - span + length])
+
+    # sum over the neighborhood of every cell, the cell itself included. planes is (..., size, size)
+    def box_sum(self, planes):
+        planes = np.asarray(planes, dtype=float)
+        rows = self._sum_1d(planes)
+        return np.swapaxes(self._sum_1d(np.swapaxes(rows, -1, -2)), -1, -2)
+
+    # maximum over the neighborhood of every cell, the cell itself included
+    def box_max(self, planes):
+        planes = np.asarray(planes, dtype=float)
+        rows = self._max_1d(planes)
+        return np.swapaxes(self._max_1d(np.swapaxes(rows, -1, -2)), -1, -2)
+
+    # sum of per-cell values over the neighbors of the same type, the cell itself excluded
+    def same_type_sum(self, values):
+        planes = np.zeros((self.n_types, self.n))
+        planes[self.types, np.arange(self.n)] = values
+        sums = self.box_sum(planes.reshape(self.n_types, self.size, self.size)).reshape(self.n_types, self.n)
+        return sums[self.types, np.arange(self.n)] - values
+
+    # maximum of per-cell values over the neighbors of the same type, the cell itself included
+    def same_type_max(self, values):
+        planes = np.full((self.n_types, self.n), -np.inf)
+        planes[self.types, np.arange(self.n)] = values
+        maxima = self.box_max(planes.reshape(self.n_types, self.size, self.size)).reshape(self.n_types, self.n)
+        return maxima[self.types, np.arange(self.n)]
+
+    # cell reached from `cells` through neighborhood slot `slots`, and whether that slot is a
+    # neighbor the cell can learn from (same_type=True) or play with (same_type=False)
+    def targets(self, cells, slots, same_type):
+        nx = self.x[cells] + self.offsets[slots, 0]
+        ny = self.y[cells] + self.offsets[slots, 1]
+        if self.topology == 'toroidal':
+            nx %= self.size
+            ny %= self.size
+            valid = np.ones(nx.shape, dtype=bool)
+        else:
+            valid = (nx >= 0) & (nx < self.size) & (ny >= 0) & (ny < self.size)
+            nx = np.clip(nx, 0, self.size - 1)
+            ny = np.clip(ny, 0, self.size - 1)
+        target = nx * self.size + ny
+        if self.n_types > 1:
+            valid &= (self.types[target] == self.types[cells]) == same_type
+        return target, valid
+
+    # one valid neighbor per cell, uniformly at random by rejection, -1 where there is none
+    def pick(self, rng, same_type):
+        counts = self.learn_counts if same_type else self.partner_counts
+        result = np.full(self.n, -1)
+        pending = np.flatnonzero(counts > 0)
+        while len(pending):
+            target, valid = self.targets(pending, rng.integers(len(self.offsets), size=len(pending)), same_type)
+            result[pending[valid]] = target[valid]
+            pending = pending[~valid]
+        return result
+
+    # every slot of the neighborhoods of `cells` as an (m, k) table with its valid mask, for the
+    # few cells that need all of them
+    def table(self, cells, same_type):
+        slots = np.broadcast_to(np.arange(len(self.offsets)), (len(cells), len(self.offsets)))
+        return self.targets(cells[:, None], slots, same_type)
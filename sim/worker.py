@@ -0,0 +1,88 @@
+"""
+worker.py runs a Simulation on a background thread. The thread steps as fast as the engine
+allows and publishes snapshots of the grid through a small bounded queue; a display reads only
+the latest one, so frames it has no time for are dropped instead of slowing the simulation.
+"""
+
+import queue
+import threading
+import time
+
+# state of the simulation after one iteration, safe to read from another thread
+class Snapshot:
+    __slots__ = ('iteration', 'strategies', 'counts', 'mean_score')
+
+    def __init__(self, sim):
+        self.iteration = sim.iteration
+        self.strategies = sim.strategy_grid().copy()
+        self.counts = sim.strategy_counts()
+        self.mean_score = sim.mean_score()
+
+class SimulationWorker:
+    def __init__(self, sim, on_iteration=None, max_snapshots=2, publish_interval=1 / 60):
+        self.sim = sim
+        # called on the worker thread after every iteration, e.g. to record metrics. returning
+        # True stops the worker
+        self.on_iteration = on_iteration
+        self.snapshots = queue.Queue(maxsize=max_snapshots)
+        # snapshots are only taken this often (seconds), a display cannot show more anyway
+        self.publish_interval = publish_interval
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # ask the worker to stop after the current iteration and wait for it
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # newest published snapshot, None if nothing new was published since the last call
+    def latest(self):
+        snapshot = None
+        while True:
+            try:
+                snapshot = self.snapshots.get_nowait()
+            except queue.Empty:
+                return snapshot
+
+    def _run(self):
+        last_publish = 0.0
+        try:
+            while not self._stop.is_set():
+                self.sim.run_iteration()
+                if self.on_iteration is not None and self.on_iteration(self.sim):
+                    self._stop.set()
+                now = time.perf_counter()
+                if now - last_publish >= self.publish_interval:
+                    self._publish()
+                    last_publish = now
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            # the final state is always published
+            self._publish()
+
+    # drop the oldest snapshot when the display has not caught up
+    def _publish(self):
+        snapshot = Snapshot(self.sim)
+        while True:
+            try:
+                self.snapshots.put_nowait(snapshot)
+                return
+            except queue.Full:
+                try:
+                    self.snapshots.get_nowait()
+                except queue.Empty:
+                    pass
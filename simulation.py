@@ -3,31 +3,222 @@ simulation.py contains methods neccesary for setting up and running the simulati
 of the game. This class sets up the game grid and update interactions between agents.
 '''
 import numpy as np
+from functools import cached_property
 from sim.game import GameType
 import random
 from sim.agent import Agent
+from sim.history import History
+from sim.neighborhood import neighbor_table
+from sim.profiling import Profiler
+
+PAYOFF_MODES = ('pairwise', 'total', 'expected')
+# events that Simulation.add_hook can attach callbacks to, each callback is called with the simulation
+HOOKS = ('on_iteration_start', 'on_iteration_end')
 
 class SpatialConfig:
-    def __init__(self, size=50, radius=1, mobility=False, topology='toroidal', strategy_distribution=None):
+    def __init__(self, size=50, radius=1, mobility=False, topology='toroidal', strategy_distribution=None, matching='independent',
+                 payoff_mode='pairwise'):
         self.size = size
         # interaction radius, default set to 1: only interacting with immediate neighbors. If radius < 1 it is fully random.
         self.radius = radius
         # stretch goal: should agents be allowed to move? we start with agents stuck in place, only interacting with neighbors, then explore this later
         self.mobility = mobility
-        # default topology is toroidal. this means agents at edges interact with agents at opposite edges. this eliminates weird edge effects. can try classic bounded edges as well
+        # default topology is toroidal. this means agents at edges interact with agents at opposite edges. this eliminates weird edge effects. 'bounded' gives agents at the edges fewer neighbors
         self.topology = topology
         # dict mapping strategy names to their desired proportions (must sum to 1)
         self.strategy_distribution = strategy_distribution
+        # only used when radius < 1. 'independent': every agent draws a random partner, 'perfect': the population is split into random pairs (vectorized engine only)
+        if matching not in ('independent', 'perfect'):
+            raise ValueError(f"Unknown matching '{matching}'")
+        self.matching = matching
+        # only used when radius >= 1. 'pairwise': every agent plays one random neighbor per iteration, 'total' or 'expected': the sum or the mean of the payoffs against every neighbor (vectorized engine only)
+        if payoff_mode not in PAYOFF_MODES:
+            raise ValueError(f"Unknown payoff mode '{payoff_mode}', expected one of {PAYOFF_MODES}")
+        self.payoff_mode = payoff_mode
 
 class Simulation:
-    def __init__(self, game_type, config, dynamic, agent_types=[]):
+    def __init__(self, game_type, config, dynamic, agent_types=[], engine='object', seed=None, workers=None, tiles=None,
+                 active_set=False, schedule='synchronous', profile=False, game_config=None):
         self.game_type = game_type
-        self.game_config = game_type.value
+        # a copy of the game with its own payoffs (e.g. from a checkpoint), or the game itself
+        self.game_config = game_config or game_type.value
         self.config = config
         self.dynamic = dynamic
         self.agent_types = agent_types
-        self.grid = self._init_grid()
+        self.seed = seed
+        self.iteration = 0
+        self.engine_name = engine
+        # 'object' runs the Agent grid below, 'vectorized' runs the array-backed VectorizedEngine,
+        # 'parallel' the same on worker processes that each own a strip of the grid
+        if active_set and engine != 'vectorized':
+            raise ValueError("Active-set updates need engine='vectorized'")
+        if schedule != 'synchronous' and engine != 'vectorized':
+            raise ValueError("Asynchronous schedules need engine='vectorized'")
+        # the engines are only imported when used, the parallel one loads multiprocessing
+        if engine == 'vectorized':
+            from sim.engine import VectorizedEngine
+            self.engine = VectorizedEngine(self.game_config, config, dynamic, agent_types, seed=seed,
+                                           active_set=active_set, schedule=schedule)
+        elif engine == 'parallel':
+            from sim.parallel import ParallelEngine
+            self.engine = ParallelEngine(self.game_config, config, dynamic, agent_types, seed=seed,
+                                         workers=workers, tiles=tiles)
+        elif engine == 'object':
+            if config.radius < 1 and config.matching != 'independent':
+                raise ValueError("Perfect matching needs engine='vectorized'")
+            if config.radius >= 1 and config.payoff_mode != 'pairwise':
+                raise ValueError("Neighborhood payoffs need engine='vectorized'")
+            self.engine = None
+            # agents keep a bounded history of action ids
+            self.actions = self.game_config.action_list()
+            self.action_ids = {action: i for i, action in enumerate(self.actions)}
+            self.history_depth = self.game_config.history_depth()
+            # the object path draws from the module level generators
+            if seed is not None:
+                random.seed(seed)
+                np.random.seed(seed)
+            self._grid = self._init_grid()
+            # agents of the next iteration are written into a second grid that is swapped in,
+            # so no Agent is allocated while running
+            self._back_grid = None
+            self._strategy_ids = {strategy: i for i, strategy in enumerate(self.game_config.strategies)}
+            self._type_ids = {agent_type: i for i, agent_type in enumerate(agent_types)}
+            self.recount()
+        else:
+            raise ValueError(f"Unknown engine '{engine}'")
+        if config.radius < 1 and self.engine is None:
+            # well mixed: flat indices of the cells of each type, and of the cells of every other type
+            self._type_cells = {}
+            for cell, agent in enumerate(self.grid.flat):
+                self._type_cells.setdefault(agent.type, []).append(cell)
+            self._other_cells = {t: [cell for other, cells in self._type_cells.items() if other != t for cell in cells]
+                                 for t in self._type_cells}
         self.payoffs = self.game_config.payoff_matrix
+        self.hooks = {name: [] for name in HOOKS}
+        self.profiler = None
+        self.set_profiling(profile)
+
+    # turns the timing of the phases of an iteration on or off, see profiling.py. a profiler
+    # that is already on keeps its samples
+    def set_profiling(self, enabled):
+        if not enabled:
+            self.profiler = None
+        elif self.profiler is None:
+            self.profiler = Profiler()
+        if self.engine is not None:
+            self.engine.profiler = self.profiler
+
+    # calls `callback(simulation)` on every `event` of HOOKS, e.g. to attach a custom probe
+    def add_hook(self, event, callback):
+        if event not in self.hooks:
+            raise ValueError(f"Unknown hook '{event}', expected one of {HOOKS}")
+        self.hooks[event].append(callback)
+
+    def remove_hook(self, event, callback):
+        self.hooks[event].remove(callback)
+
+    # stops the worker processes of the parallel engine, nothing to do for the others
+    def close(self):
+        if hasattr(self.engine, 'close'):
+            self.engine.close()
+
+    # neighbor index table of the grid, built on first use (it is large for a large radius)
+    @cached_property
+    def neighbor_table(self):
+        return neighbor_table(self.config.size, self.config.radius, self.config.topology)
+
+    # grid of Agent objects. for the vectorized engine these are views into its Population
+    @property
+    def grid(self):
+        if self.engine is not None:
+            return self.engine.population.agents()
+        return self._grid
+
+    @grid.setter
+    def grid(self, grid):
+        self._grid = grid
+        self._back_grid = None
+        self.recount()
+
+    # rebuild the strategy counts and total score from the agents. they are kept up to date while
+    # running, this is only needed after agents were changed from outside
+    def recount(self):
+        if self.engine is not None:
+            pop = self.engine.population
+            pop.type_counts[:] = 0
+            np.add.at(pop.type_counts, (pop.types, pop.strategies), 1)
+            pop.total_score = float(pop.scores.sum())
+            pop.touched = None
+            return
+        self._type_counts = np.zeros((max(len(self.agent_types), 1), len(self.game_config.strategies)), dtype=np.int64)
+        self.total_score = 0.0
+        for agent in self._grid.flat:
+            self._type_counts[self._type_ids.get(agent.type, 0), self._strategy_ids[agent.strategy]] += 1
+            self.total_score += agent.score
+
+    # agents per (type, strategy) as an array, one row per agent type (a single row when untyped)
+    def type_count_array(self):
+        if self.engine is not None:
+            return self.engine.population.type_counts
+        return self._type_counts
+
+    # strategy index of every cell, in the order of game_config.strategies
+    def strategy_grid(self):
+        if self.engine is not None:
+            return self.engine.population.strategies.reshape(self.config.size, self.config.size)
+        index = {strategy: i for i, strategy in enumerate(self.game_config.strategies)}
+        return np.array([[index[agent.strategy] for agent in row] for row in self.grid])
+
+    # type index of every cell in the order of agent_types, all 0 in untyped games
+    def type_ids(self):
+        if self.engine is not None:
+            return self.engine.population.types
+        return np.array([self._type_ids.get(agent.type, 0) for agent in self.grid.flat])
+
+    # number of agents playing each strategy
+    def strategy_counts(self):
+        counts = self.type_count_array().sum(axis=0)
+        return {strategy.name: int(count) for strategy, count in zip(self.game_config.strategies, counts)}
+
+    # number of agents of each type playing each strategy, empty in untyped games
+    def type_counts(self):
+        if len(self.agent_types) < 2:
+            return {}
+        names = [strategy.name for strategy in self.game_config.strategies]
+        return {agent_type: dict(zip(names, map(int, row)))
+                for agent_type, row in zip(self.agent_types, self.type_count_array())}
+
+    # sum of the scores of all agents
+    def score_total(self):
+        if self.engine is not None:
+            return float(self.engine.population.total_score)
+        return float(self.total_score)
+
+    # average score over the population
+    def mean_score(self):
+        return self.score_total() / self.config.size ** 2
+
+    # Monte Carlo steps simulated, i.e. strategy updates per agent. every schedule does one per
+    # iteration, so runs with different schedules compare at equal values
+    def mc_time(self):
+        return float(self.iteration)
+
+    # strategy updates evaluated by an asynchronous schedule so far, None when synchronous
+    def update_events(self):
+        scheduler = getattr(self.engine, 'scheduler', None)
+        return None if scheduler is None else scheduler.events
+
+    # population statistics of the current iteration. everything is maintained while running, so
+    # this does not look at the agents
+    def stats(self):
+        return {
+            'iteration': self.iteration,
+            'counts': self.strategy_counts(),
+            'type_counts': self.type_counts(),
+            'total_score': self.score_total(),
+            'mean_score': self.mean_score(),
+            'mc_time': self.mc_time(),
+        }
 
     def _init_grid(self):
         grid = np.empty((self.config.size, self.config.size), dtype=object)
@@ -71,28 +262,32 @@ class Simulation:
                         type_count = type_count + 1
                     else:
                         grid[x,y] = Agent(random.choice(strategies), (x,y))
-        
+
+        for agent in grid.flat:
+            agent.history = self._new_history()
         return grid
 
+    def _new_history(self):
+        return History(self.history_depth, self.actions, self.action_ids)
+
     def _get_neighbors(self, agent):
         x, y = agent.position
-        neighbors = []
-        while self.config.radius < 1:
-            nx = random.randint(0, self.config.size-1)
-            ny = random.randint(0, self.config.size-1)
-            if nx != x and ny != y and self.grid[nx, ny].type is not None and self.grid[nx, ny].type == agent.type and len(neighbors) < 1:
-                neighbors.append(self.grid[nx, ny])
-            if nx != x and ny != y and (self.grid[nx, ny].type is None or (self.grid[nx, ny].type != agent.type and len(neighbors) >= 1)):
-                neighbors.append(self.grid[nx, ny])
-                return neighbors
-        for dx in range(-self.config.radius, self.config.radius+1):
-            for dy in range(-self.config.radius, self.config.radius+1):
-                if dx == 0 and dy == 0:
-                    continue
-                nx = (x + dx) % self.config.size
-                ny = (y + dy) % self.config.size
-                neighbors.append(self.grid[nx, ny])
-        return neighbors
+        if self.config.radius < 1:
+            # a random agent of the same type to learn from and a random partner of another type,
+            # or a single random partner in untyped games
+            cell = x * self.config.size + y
+            if agent.type is None:
+                return [self.grid.flat[self._random_cell(self._type_cells[None], cell)]]
+            same = self._random_cell(self._type_cells[agent.type], cell)
+            other = random.choice(self._other_cells[agent.type])
+            return [self.grid.flat[same], self.grid.flat[other]]
+        cells = self.neighbor_table.rows[x * self.config.size + y]
+        return list(self.grid.flat[cells])
+
+    # uniform over the cells, skipping the given one
+    def _random_cell(self, cells, skip):
+        cell = cells[random.randrange(len(cells) - 1)]
+        return cells[-1] if cell == skip else cell
 
     def _interact(self, a1, a2):
         a1_action = a1.strategy.act(a1.history, a1.type)
@@ -104,16 +299,58 @@ class Simulation:
         a2.history.append((a2_action, a1_action))
 
     def run_iteration(self):
-        new_grid = np.copy(self.grid)
-        for agent in self.grid.flatten():
+        self.iteration += 1
+        for callback in self.hooks['on_iteration_start']:
+            callback(self)
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
+        if self.engine is not None:
+            self.engine.step()
+        else:
+            self._step_agents(profiler)
+        if profiler is not None:
+            profiler.finish()
+        for callback in self.hooks['on_iteration_end']:
+            callback(self)
+
+    # one iteration of the object engine. the phases of every agent are timed when profiling
+    def _step_agents(self, profiler):
+        if self._back_grid is None:
+            self._back_grid = np.empty_like(self._grid)
+            for agent in self._grid.flat:
+                self._back_grid[agent.position] = Agent(agent.strategy, agent.position, agent.type, self._new_history())
+        new_grid = self._back_grid
+        counts = self._type_counts
+        total_score = 0.0
+        for agent in self.grid.flat:
             neighbors = self._get_neighbors(agent)
+            if profiler is not None:
+                profiler.lap('neighbors')
             if neighbors:
                 partner = random.choice(neighbors)
                 while agent.type is not None and partner.type == agent.type:
                     partner = random.choice(neighbors)
+                if profiler is not None:
+                    profiler.lap('partners')
                 self._interact(agent, partner)
+                if profiler is not None:
+                    profiler.lap('interact')
             # Update strategy
             new_strat = self.dynamic(agent, neighbors)
-            new_grid[agent.position] = Agent(new_strat, agent.position, agent.type)
-            new_grid[agent.position].score = agent.score
-        self.grid = new_grid
\ No newline at end of file
+            if profiler is not None:
+                profiler.lap('learn')
+            new_agent = new_grid[agent.position]
+            if new_strat is not agent.strategy:
+                row = self._type_ids.get(agent.type, 0)
+                counts[row, self._strategy_ids[agent.strategy]] -= 1
+                counts[row, self._strategy_ids[new_strat]] += 1
+            new_agent.strategy = new_strat
+            new_agent.score = agent.score
+            total_score += agent.score
+            new_agent.prev_score = 0
+            new_agent.history.clear()
+            if profiler is not None:
+                profiler.lap('count')
+        self.total_score = total_score
+        self._grid, self._back_grid = new_grid, self._grid
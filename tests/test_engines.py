@@ -0,0 +1,121 @@
+"""
+test_engines.py checks that the vectorized engine runs the model of the object engine: the same
+sweep replayed agent by agent gives the same actions and scores, and seeded runs of the two
+engines end with matching strategy proportions. It also checks that every replica of an
+ensemble runs exactly like a single vectorized Simulation seeded with the replica's seed.
+
+    python -m pytest tests
+"""
+
+import numpy as np
+import pytest
+from sim.ensemble import build_ensemble
+from sim.game import GameType
+from sim.neighborhood import pick_neighbors
+from sim.run import build_simulation
+
+SIZE = 20
+ITERATIONS = 15
+SEEDS = 24
+# allowed difference of the mean proportions, in standard errors of the difference
+Z_LIMIT = 4
+
+CASES = [
+    (GameType.HD, 'replicator', 1, 'toroidal'),
+    (GameType.PD, 'replicator', 1, 'toroidal'),
+    (GameType.PD, 'fermi', 1, 'toroidal'),
+    (GameType.SH, 'moran', 2, 'bounded'),
+    (GameType.BS, 'aspiration', 0, 'toroidal'),
+]
+
+def final_proportions(game, dynamic, radius, topology, engine, seed):
+    sim = build_simulation(game, dynamic, radius=radius, size=SIZE, topology=topology, engine=engine, seed=seed)
+    for _ in range(ITERATIONS):
+        sim.run_iteration()
+    return np.array(list(sim.strategy_counts().values())) / SIZE ** 2
+
+@pytest.mark.parametrize('game, dynamic, radius, topology', CASES)
+def test_same_proportions(game, dynamic, radius, topology):
+    runs = {engine: np.array([final_proportions(game, dynamic, radius, topology, engine, seed)
+                              for seed in range(SEEDS)])
+            for engine in ('object', 'vectorized')}
+    a, b = runs['object'], runs['vectorized']
+    error = np.sqrt((a.var(axis=0) + b.var(axis=0)) / SEEDS) + 1 / SIZE ** 2
+    z = np.abs(a.mean(axis=0) - b.mean(axis=0)) / error
+    assert (z <= Z_LIMIT).all(), f"object {a.mean(axis=0).round(3)}, vectorized {b.mean(axis=0).round(3)}"
+
+# the sweep of the object engine played one event at a time with explicit histories
+def replay(engine, players, partners, actions):
+    pop = engine.population
+    histories = [[] for _ in range(engine.n)]
+    expected = []
+    for e, (player, partner) in enumerate(zip(players, partners)):
+        pair = []
+        for j, cell in enumerate((player, partner)):
+            strategy = engine.game_config.strategies[pop.strategies[cell]]
+            if engine.mixed[pop.strategies[cell]]:
+                # a random draw, taken from the engine
+                pair.append(actions[2 * e + j])
+                continue
+            history = [(engine.actions[own], engine.actions[opp]) for own, opp in histories[cell]]
+            recent = history[-strategy.memory:] if strategy.memory else []
+            pair.append(engine.action_ids[strategy.act(recent, pop.type_name(cell))])
+        histories[player].append((pair[0], pair[1]))
+        histories[partner].append((pair[1], pair[0]))
+        expected += pair
+    return np.array(expected)
+
+@pytest.mark.parametrize('game', list(GameType))
+@pytest.mark.parametrize('radius, topology', [(1, 'toroidal'), (2, 'bounded'), (0, 'toroidal')])
+def test_sweep_replay(game, radius, topology):
+    sim = build_simulation(game, 'replicator', radius=radius, size=9, topology=topology, engine='vectorized', seed=3)
+    engine = sim.engine
+    pop = engine.population
+    rng = np.random.default_rng(1)
+    pop.scores[:] = rng.random(engine.n) * 5
+    if engine.well_mixed:
+        partners = engine.mixing.partners(rng)
+        pool = engine.mixing.partners(rng, same_type=True) if engine.agent_types else partners
+        pool = pool[:, None]
+        valid = pool >= 0
+    else:
+        partners = pick_neighbors(engine.neighbors, engine.partner_valid, rng)
+        pool = engine.neighbors
+        valid = np.ones(pool.shape, dtype=bool) if engine.learn_valid is None else engine.learn_valid
+    players = np.flatnonzero(partners >= 0)
+    partners = partners[players]
+
+    actions = engine._sweep_actions(players, partners)
+    assert (actions == replay(engine, players, partners, actions)).all()
+
+    payoffs = engine.payoff_matrix[actions[0::2], actions[1::2]]
+    event = dict(zip(players.tolist(), range(len(players))))
+    scores = pop.scores.copy()
+    expected_seen = np.zeros(pool.shape)
+    for cell in range(engine.n):
+        if cell in event:
+            e = event[cell]
+            scores[players[e]] += payoffs[e, 0]
+            scores[partners[e]] += payoffs[e, 1]
+        expected_seen[cell] = scores[pool[cell]]
+    seen = engine._seen_scores(scores, players, partners, payoffs, pool)
+    assert np.allclose(seen[valid], expected_seen[valid])
+
+@pytest.mark.parametrize('game, dynamic, active_set, topology', [
+    (GameType.HD, 'fermi', False, 'toroidal'),
+    (GameType.RPS, 'moran', True, 'bounded'),
+])
+def test_replica_streams(game, dynamic, active_set, topology):
+    replicas = 3
+    ensemble = build_ensemble(game, dynamic, replicas, size=12, topology=topology, seed=7, active_set=active_set)
+    singles = [build_simulation(game, dynamic, size=12, topology=topology, engine='vectorized',
+                                seed=ensemble.replica_seed(r), active_set=active_set)
+               for r in range(replicas)]
+    for _ in range(ITERATIONS):
+        ensemble.run_iteration()
+        for sim in singles:
+            sim.run_iteration()
+    grids = ensemble.strategy_grids()
+    for r, sim in enumerate(singles):
+        assert (grids[r] == sim.strategy_grid()).all()
+    assert len({grid.tobytes() for grid in grids}) == replicas
@@ -0,0 +1,17 @@
+"""
+test_imports.py holds the entry points to the import budget of benchmark.py: each one is imported
+in a new interpreter, like a sweep worker starts, and must load within IMPORT_BUDGET seconds
+without pulling in the GUI, plotting or export modules.
+
+    python -m pytest tests
+"""
+
+import pytest
+from benchmark import CORE_MODULES, IMPORT_BUDGET, bench_import
+
+@pytest.mark.parametrize('module', CORE_MODULES)
+def test_import_budget(module):
+    result = bench_import(module, repeats=3)
+    assert result['heavy_modules'] == [], f"import {module} loaded {result['heavy_modules']}"
+    assert result['seconds_min'] <= IMPORT_BUDGET, \
+        f"import {module} took {result['seconds_min']:.3f}s, the budget is {IMPORT_BUDGET}s"